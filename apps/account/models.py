@@ -1,22 +1,40 @@
 from django.db import models
 
 from apps.common import consts as common_consts
-from django_template.drf.djangox import BasicModel, SDBasicModel
+from db.partition import Partition
+from django_template.drf.djangox import BasicModel, Cascade, SDBasicModel
 from utils.tools import md5
 
 
-class VerifyCode(BasicModel):
+class VerifyCodeBase(BasicModel):
     id = models.AutoField(primary_key=True)
     phone = models.CharField(max_length=20)
     code = models.CharField(max_length=6)
     used = models.IntegerField(default=0)
     expiration_time = models.DateTimeField(blank=True, null=True)
 
+    class Meta:
+        abstract = True
+        managed = False
+
+    @classmethod
+    def get_table_name(cls, suffix):
+        return f"verify_code_{suffix}"
+
+
+class VerifyCode(VerifyCodeBase):
+    """
+    分区建表模板, 数据按月写入 verify_code_YYYYMM, 见 verify_codes
+    """
+
     class Meta:
         managed = False
         db_table = "verify_code"
 
 
+verify_codes = Partition(VerifyCodeBase, template="verify_code")
+
+
 class Account(SDBasicModel):
     id = models.AutoField(primary_key=True)
     phone = models.CharField(max_length=11)
@@ -25,6 +43,18 @@ class Account(SDBasicModel):
     last_login = models.DateTimeField(blank=True, null=True)
     source = models.IntegerField()
 
+    soft_delete_cascade = (
+        Cascade("account.AccountInfo", "account_id"),
+        Cascade("account.WeChatAccount", "account_id"),
+        Cascade("account.AppleAccount", "account_id"),
+        Cascade(
+            "account.WeChatSubscribe",
+            "account_id",
+            values={"status": common_consts.WeChatSubscribeStatus.CANCEL},
+            filters={"status": common_consts.WeChatSubscribeStatus.INIT},
+        ),
+    )
+
     class Meta:
         managed = False
         db_table = "account"
@@ -70,6 +100,8 @@ class AccountInfo(SDBasicModel):
     city_code = models.CharField(max_length=20)
     district_code = models.CharField(max_length=20)
 
+    version_fields = ("account_id",)
+
     class Meta:
         managed = False
         db_table = "account_info"
@@ -9,7 +9,8 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 
 from apps.account import consts, serializers
 from apps.account.models import Account, AccountInfo
-from django_template.drf import APIException, JSONResponse
+from apps.common import tasks
+from django_template.drf import APIException, ConditionalGetMixin, JSONResponse
 from helper.sms import SMSService
 from utils.redisx import RateLimitException
 
@@ -31,8 +32,9 @@ class CaptchaView(generics.GenericAPIView):
 
         try:
             captcha = SMSService.gen_code(phone)
-        except RateLimitException:
-            raise APIException("操作过于频繁，请稍后再试", code=g_consts.Code.RATE_LIMIT_400)
+        except RateLimitException as e:
+            headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+            raise APIException("操作过于频繁，请稍后再试", code=g_consts.Code.RATE_LIMIT_400, headers=headers)
 
         transaction.on_commit(lambda: SMSService.send_sms(phone, captcha))
         return JSONResponse()
@@ -87,14 +89,23 @@ class AccountLogoutView(generics.GenericAPIView):
         # if not is_deregister:
         #     raise APIException(msg='暂时不可注销')
 
-        # 删除账号
-        instance.delete()
+        # 删除账号, 关联数据提交后异步级联软删除
+        instance.delete(cascade=False)
+        transaction.on_commit(
+            partial(tasks.cascade_soft_delete.delay, Account._meta.label, instance.pk, instance.delete_ts)
+        )
         return JSONResponse()
 
 
-class AccountInfoView(RetrieveUpdateAPIView):
+class AccountInfoView(ConditionalGetMixin, RetrieveUpdateAPIView):
     serializer_class = serializers.AccountInfoSerializer
 
+    def get_version(self, request, *args, **kwargs):
+        # request.user 已由认证加载, 只需读取 AccountInfo 的版本号缓存
+        user = request.user
+        account_version = int(user.update_ts.timestamp() * 1000)
+        return max(account_version, AccountInfo.get_version(account_id=user.id))
+
     def get_queryset(self):
         user_id = self.request.user.id
         instance = Account.objects.get(id=user_id)
@@ -0,0 +1,63 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from db.archive import Archiver, archive_table, soft_delete_models
+from django_template.drf.models import SDBasicModel
+from utils.redisx import AcquireLockError
+
+
+class Command(BaseCommand):
+    help = "把软删除超过 N 天的行按主键分批移动到 <table>_archive, 可中断后继续"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", action="append", help="app_label.Model, 可多次指定, 默认全部 SDBasicModel")
+        parser.add_argument("--days", type=int, default=30, help="软删除超过多少天")
+        parser.add_argument("--chunk-size", type=int, default=500, help="每批行数")
+        parser.add_argument("--sleep", type=float, default=0.1, help="每批之间的间隔(秒)")
+        parser.add_argument("--max-chunks", type=int, default=0, help="每张表最多处理批数, 0 不限制")
+        parser.add_argument("--database", help="数据库别名, 默认按 router 的写库")
+        parser.add_argument("--dry-run", action="store_true", help="只统计不移动")
+        parser.add_argument("--reset", action="store_true", help="清除断点, 从头扫描")
+
+    def get_models(self, labels):
+        if not labels:
+            return soft_delete_models()
+
+        models = []
+        for label in labels:
+            try:
+                model = apps.get_model(label)
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+            if not issubclass(model, SDBasicModel):
+                raise CommandError(f"{label} is not a SDBasicModel")
+            models.append(model)
+        return models
+
+    def handle(self, *args, **options):
+        for model in self.get_models(options["model"]):
+            archiver = Archiver(
+                model,
+                days=options["days"],
+                chunk_size=options["chunk_size"],
+                sleep=options["sleep"],
+                using=options["database"],
+                dry_run=options["dry_run"],
+            )
+            if options["reset"]:
+                archiver.reset()
+
+            table = model._meta.db_table
+
+            def progress(moved, last_pk, total):
+                self.stdout.write(f"  {table}: {moved}/{total} (last pk {last_pk})")
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{table} -> {archive_table(model)}"))
+            try:
+                moved = archiver.run(options["max_chunks"], progress)
+            except AcquireLockError:
+                self.stderr.write(f"  {table}: another archiver is running, skipped")
+                continue
+            self.stdout.write(
+                self.style.SUCCESS(f"  {table}: {'would move' if options['dry_run'] else 'moved'} {moved} rows")
+            )
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from db.advisor import QueryRecorder, advise, summarize
+
+
+class Command(BaseCommand):
+    help = (
+        "对记录的查询形态执行 EXPLAIN, 标记全表扫描并给出包含 delete_ts 的组合索引建议; "
+        "输入为 db.advisor.record_queries 导出的 jsonl 或 django.db.backends 的 DEBUG 日志"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--input", action="append", required=True, help="jsonl 或日志文件, 可多次指定")
+        parser.add_argument("--min-count", type=int, default=1, help="忽略出现次数小于该值的形态")
+        parser.add_argument("--table", action="append", help="只输出指定表")
+        parser.add_argument("--json", action="store_true", help="输出 json")
+
+    def handle(self, *args, **options):
+        recorder = QueryRecorder()
+        for path in options["input"]:
+            try:
+                recorder.load(path)
+            except OSError as e:
+                raise CommandError(str(e))
+
+        report = advise(recorder, options["min_count"])
+        if options["table"]:
+            report = [row for row in report if row["table"] in options["table"]]
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+            return
+
+        for row in sorted(report, key=lambda r: (not r["full_scan"], -r["count"])):
+            flag = self.style.ERROR("FULL SCAN") if row["full_scan"] else "ok"
+            self.stdout.write(f"[{flag}] {row['model']}({row['table']}) x{row['count']}")
+            self.stdout.write(f"    {row['shape']}")
+            for plan in row["plan"]:
+                self.stdout.write(f"    plan: {plan}")
+            if row["suggest"]:
+                self.stdout.write(self.style.WARNING(f"    suggest: ({', '.join(row['suggest'])})"))
+
+        summary = summarize(report)
+        if summary:
+            self.stdout.write("")
+            self.stdout.write(self.style.MIGRATE_HEADING("建议索引:"))
+        for table, suggestions in summary.items():
+            for columns, count in sorted(suggestions.items(), key=lambda kv: -kv[1]):
+                name = "idx_" + "_".join(columns)
+                self.stdout.write(
+                    f"  ALTER TABLE `{table}` ADD INDEX `{name}` ({', '.join(f'`{c}`' for c in columns)});  -- x{count}"
+                )
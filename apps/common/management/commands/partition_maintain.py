@@ -0,0 +1,31 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from db.partition import partitions
+
+
+class Command(BaseCommand):
+    help = "预建后续周期的分区表, 并 DROP 超出保留期的分区表"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep", type=int, default=6, help="保留的周期数(含当前), 至少为 1")
+        parser.add_argument("--ahead", type=int, default=1, help="预建之后多少个周期的分区")
+        parser.add_argument("--dry-run", action="store_true", help="只输出不执行")
+
+    def handle(self, *args, **options):
+        if options["keep"] < 1:
+            raise CommandError("--keep must be >= 1, the current partition is always kept")
+
+        # 分区在各 app 的 models 中声明
+        apps.check_models_ready()
+
+        for partition in partitions:
+            created, dropped = partition.maintain(options["keep"], options["ahead"], options["dry_run"])
+            name = partition.base_cls.get_table_name(suffix="*")
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for table in created:
+                self.stdout.write(f"  create {table}")
+            for table in dropped:
+                self.stdout.write(self.style.WARNING(f"  drop {table}"))
+            if not created and not dropped:
+                self.stdout.write("  nothing to do")
@@ -0,0 +1,173 @@
+import json
+import re
+import time
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.redisx import _get_redis
+
+# 前缀 -> 产生该前缀的调用方
+PREFIXES = {
+    "cf": "cache_fn/cache_many_fn",
+    "cl": "currency_lock/CurrencyLock",
+    "rl": "RateLimit/MultiRateLimit",
+    "cs": "semaphore/Semaphore",
+    "crw": "rw_lock/RWLock",
+}
+
+# TTL 分布(秒)
+TTL_BUCKETS = [
+    ("<1m", 60),
+    ("<1h", 3600),
+    ("<1d", 86400),
+    (">=1d", None),
+]
+
+_NUMBER = re.compile(r"\d+")
+_HEX = re.compile(r"^[0-9a-f]{16,}$")
+
+
+def key_pattern(key):
+    """
+    cf:account:123:profile -> cf:account:{n}:profile
+    """
+    parts = []
+    for part in key.split(":"):
+        if part.isdigit():
+            parts.append("{n}")
+        elif _HEX.match(part):
+            parts.append("{hex}")
+        else:
+            parts.append(_NUMBER.sub("#", part))
+    return ":".join(parts)
+
+
+def ttl_bucket(ttl):
+    """
+    :param ttl: -1 没有过期时间; -2 已过期, 调用方应跳过
+    """
+    if ttl == -1:
+        return "no_ttl"
+    for name, limit in TTL_BUCKETS:
+        if limit is None or ttl < limit:
+            return name
+
+
+class Command(BaseCommand):
+    help = "统计 redisx 前缀下的 key 数量、内存占用及 TTL 分布(SCAN 增量扫描, 不使用 KEYS)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prefix", action="append", help="key 前缀, 可多次指定, 默认全部 redisx 前缀")
+        parser.add_argument("--count", type=int, default=500, help="每次 SCAN 的 COUNT")
+        parser.add_argument("--sample", type=int, default=200, help="每个 pattern 最多采样 MEMORY USAGE 的 key 数")
+        parser.add_argument("--sleep", type=float, default=0.01, help="每批 SCAN 之间的间隔(秒)")
+        parser.add_argument("--max-keys", type=int, default=0, help="每个前缀最多扫描的 key 数, 0 不限制")
+        parser.add_argument("--examples", type=int, default=5, help="每个 pattern 列出的无 TTL key 数")
+        parser.add_argument("--json", action="store_true", help="输出 json")
+
+    def handle(self, *args, **options):
+        client = _get_redis()
+        if client is None:
+            raise CommandError("redis cache backend is required")
+
+        # cache.make_key("") -> "{KEY_PREFIX}:{VERSION}:"
+        head = cache.make_key("")
+        report = {}
+        for prefix in options["prefix"] or list(PREFIXES):
+            stats = self.scan(client, head, prefix, options)
+            report.update(stats)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+        else:
+            self.print_report(report)
+
+    def scan(self, client, head, prefix, options):
+        stats = defaultdict(
+            lambda: {
+                "caller": PREFIXES.get(prefix, ""),
+                "count": 0,
+                "sampled": 0,
+                "sampled_bytes": 0,
+                "ttl": defaultdict(int),
+                "no_ttl_examples": [],
+            }
+        )
+        match = f"{head}{prefix}:*"
+        scanned = 0
+        cursor = 0
+        while True:
+            cursor, keys = client.scan(cursor=cursor, match=match, count=options["count"])
+            keys = [k.decode() if isinstance(k, bytes) else k for k in keys]
+            if keys:
+                self.collect(client, head, keys, stats, options)
+                scanned += len(keys)
+
+            if cursor == 0 or (options["max_keys"] and scanned >= options["max_keys"]):
+                break
+            time.sleep(options["sleep"])
+
+        for item in stats.values():
+            item["ttl"] = dict(item["ttl"])
+            avg = item["sampled_bytes"] / item["sampled"] if item["sampled"] else 0
+            item["estimated_bytes"] = int(avg * item["count"])
+        return stats
+
+    def collect(self, client, head, keys, stats, options):
+        patterns = [key_pattern(k[len(head) :]) for k in keys]
+
+        pipe = client.pipeline(transaction=False)
+        for k in keys:
+            pipe.ttl(k)
+        ttls = pipe.execute()
+
+        pipe = client.pipeline(transaction=False)
+        sampled = []
+        pending = defaultdict(int)
+        for k, pattern in zip(keys, patterns):
+            if stats[pattern]["sampled"] + pending[pattern] < options["sample"]:
+                pipe.memory_usage(k, samples=5)
+                sampled.append(pattern)
+                pending[pattern] += 1
+        # 部分云服务禁用了 MEMORY 命令
+        usages = pipe.execute(raise_on_error=False) if sampled else []
+
+        for pattern, usage in zip(sampled, usages):
+            if not isinstance(usage, int):
+                continue
+            item = stats[pattern]
+            item["sampled"] += 1
+            item["sampled_bytes"] += usage
+
+        for k, pattern, ttl in zip(keys, patterns, ttls):
+            # -2: 扫描期间已过期, 不计入
+            if ttl == -2:
+                continue
+            item = stats[pattern]
+            item["count"] += 1
+            item["ttl"][ttl_bucket(ttl)] += 1
+            if ttl == -1 and len(item["no_ttl_examples"]) < options["examples"]:
+                item["no_ttl_examples"].append(k[len(head) :])
+
+    def print_report(self, report):
+        buckets = ["no_ttl"] + [name for name, _ in TTL_BUCKETS]
+        header = ["pattern", "caller", "count", "est_bytes"] + buckets
+        rows = [header]
+        for pattern, item in sorted(report.items(), key=lambda x: -x[1]["estimated_bytes"]):
+            rows.append(
+                [pattern, item["caller"], str(item["count"]), str(item["estimated_bytes"])]
+                + [str(item["ttl"].get(b, 0)) for b in buckets]
+            )
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        for row in rows:
+            self.stdout.write("  ".join(col.ljust(width) for col, width in zip(row, widths)))
+
+        no_ttl = {p: item for p, item in report.items() if item["ttl"].get("no_ttl")}
+        if no_ttl:
+            self.stdout.write("")
+            self.stdout.write(self.style.WARNING("keys without ttl:"))
+            for pattern, item in no_ttl.items():
+                self.stdout.write(f"  {pattern}: {item['ttl']['no_ttl']} e.g. {', '.join(item['no_ttl_examples'])}")
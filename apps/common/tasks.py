@@ -0,0 +1,20 @@
+from celery import shared_task
+from django.apps import apps
+
+from django_template.drf.models import close_db
+
+
+@shared_task
+@close_db
+def cascade_soft_delete(label, pk, delete_ts, using=None):
+    """
+    级联软删除关联数据, 见 _SoftDeleteModel.soft_delete_cascade
+
+    :param label: "app_label.Model"
+    :param pk: 被删除行的主键
+    :param delete_ts: 被删除行的 delete_ts
+    :param using:
+    :return:
+    """
+    model = apps.get_model(label)
+    return model.cascade_delete(pk, delete_ts, using)
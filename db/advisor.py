@@ -0,0 +1,305 @@
+import json
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.apps import apps
+from django.db import connections
+
+from utils.tools import namedtuple_fetchall
+
+# django.db.backends DEBUG 日志: (0.001) SELECT ...; args=(...); alias=default
+_LOG_LINE = re.compile(
+    r"^.*?\(\d+\.\d+\)\s+(?P<sql>(SELECT|UPDATE|DELETE)\s.*?);\s+args=.*?(;\s+alias=(?P<alias>\w+))?\s*$", re.I
+)
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'")
+_NUMBER = re.compile(r"(?<![\w`\".])-?\d+(\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\((\s*(\?|%s)\s*,?)+\)", re.I)
+_SPACES = re.compile(r"\s+")
+
+_IDENT = r"[`\"]?(\w+)[`\"]?"
+_COLUMN = re.compile(rf"{_IDENT}\.{_IDENT}\s*(=|<=|>=|<>|!=|<|>|\bIN\b|\bIS\b|\bLIKE\b|\bBETWEEN\b)", re.I)
+_ORDER = re.compile(rf"{_IDENT}\.{_IDENT}(\s+(ASC|DESC))?", re.I)
+_RANGE_OPS = {"<", ">", "<=", ">=", "BETWEEN", "LIKE"}
+
+
+def normalize(sql):
+    """
+    SQL 归一化为查询形态, 字面量与 IN 列表替换为 ?
+
+    :param sql:
+    :return:
+    """
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (...)", sql)
+    return _SPACES.sub(" ", sql).strip()
+
+
+class QueryRecorder:
+    """
+    记录执行过的 SQL 形态, 通过 connection.execute_wrapper 挂载
+
+    每种形态保留一条样本 SQL 及参数, 用于 EXPLAIN
+    """
+
+    def __init__(self):
+        self.shapes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip()[:6].upper() in ("SELECT", "UPDATE", "DELETE"):
+            self.add(sql, params, context["connection"].alias)
+        return execute(sql, params, many, context)
+
+    def add(self, sql, params=None, alias="default", count=1):
+        shape = normalize(sql)
+        with self._lock:
+            item = self.shapes.get((alias, shape))
+            if item is None:
+                params = list(params) if params else []
+                self.shapes[(alias, shape)] = item = {
+                    "alias": alias,
+                    "shape": shape,
+                    "sql": sql,
+                    "params": params,
+                    "count": 0,
+                }
+            item["count"] += count
+
+    def dump(self, path):
+        """
+        写入 jsonl, 供 index_advisor --input 使用
+
+        :param path:
+        :return:
+        """
+        with open(path, "w") as f:
+            for item in self.shapes.values():
+                f.write(json.dumps(item, ensure_ascii=False, default=str) + "\n")
+
+    def load(self, path):
+        """
+        读取 jsonl 或 django.db.backends 的 DEBUG 日志
+
+        :param path:
+        :return:
+        """
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith("{"):
+                    item = json.loads(line)
+                    self.add(item["sql"], item.get("params"), item.get("alias", "default"), item.get("count", 1))
+                    continue
+                match = _LOG_LINE.match(line)
+                if match:
+                    self.add(match.group("sql"), None, match.group("alias") or "default")
+
+
+@contextmanager
+def record_queries(path=None, recorder=None):
+    """
+    记录代码块中所有连接执行的 SQL, 如在测试运行期间:
+
+        with record_queries("/tmp/queries.jsonl"):
+            ...
+
+    :param path: 结束后写入的文件
+    :param recorder:
+    :return:
+    """
+    recorder = recorder or QueryRecorder()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder
+    if path:
+        recorder.dump(path)
+
+
+def table_models():
+    """
+    db_table -> model
+    """
+    return {model._meta.db_table: model for model in apps.get_models()}
+
+
+def is_soft_delete(model):
+    return any(field.name == "delete_ts" for field in model._meta.concrete_fields)
+
+
+def query_columns(sql, table):
+    """
+    解析查询对 table 使用的列
+
+    :param sql:
+    :param table:
+    :return: (等值列, 范围列, 排序列)
+    """
+    upper = sql.upper()
+    where_at = upper.find(" WHERE ")
+    order_at = upper.find(" ORDER BY ")
+    where = sql[where_at : order_at if order_at > where_at else None] if where_at >= 0 else ""
+    order = sql[order_at + 10 :] if order_at >= 0 else ""
+    order = re.split(r"\bLIMIT\b", order, flags=re.I)[0]
+
+    equal, ranges, ordering = [], [], []
+    for name, column, op in _COLUMN.findall(where):
+        if name != table:
+            continue
+        target = ranges if op.upper() in _RANGE_OPS else equal
+        if column not in equal and column not in ranges:
+            target.append(column)
+    for name, column, *_ in _ORDER.findall(order):
+        if name == table and column not in ordering:
+            ordering.append(column)
+    return equal, ranges, ordering
+
+
+def suggest_index(model, equal, ranges, ordering):
+    """
+    等值列在前, 软删除表补上 delete_ts, 之后是一个范围列或排序列
+
+    :return: 列名元组, 无需索引返回 None
+    """
+    pk = model._meta.pk.column
+    columns = [c for c in equal if c not in ("delete_ts", pk)]
+    if not columns and not ranges:
+        # 仅主键/仅软删除条件, 不建议索引
+        return None
+    if is_soft_delete(model):
+        columns.append("delete_ts")
+    tail = ranges[:1] or [c for c in ordering if c not in columns][:1]
+    for column in tail:
+        if column not in columns:
+            columns.append(column)
+    return tuple(columns)
+
+
+def existing_indexes(connection, table):
+    """
+    表上已有的索引(含主键/唯一约束)列
+    """
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    return [
+        tuple(c["columns"]) for c in constraints.values() if c.get("index") or c.get("primary_key") or c.get("unique")
+    ]
+
+
+def covered(columns, indexes, pk):
+    """
+    已有索引最左前缀覆盖建议列(InnoDB 二级索引隐含主键)
+    """
+    for index in indexes:
+        index = tuple(index) + (pk,)
+        if index[: len(columns)] == columns:
+            return True
+    return False
+
+
+def explain(connection, sql, params):
+    """
+    :return: [{"table", "type", "key", "rows", "full_scan"}]
+    """
+    plans = []
+    with connection.cursor() as cursor:
+        if connection.vendor == "mysql":
+            cursor.execute(f"EXPLAIN {sql}", params or None)
+            for row in namedtuple_fetchall(cursor):
+                plans.append(
+                    {
+                        "table": row.table,
+                        "type": row.type,
+                        "key": row.key,
+                        "rows": row.rows,
+                        "full_scan": row.type == "ALL" or (row.type == "index" and not row.possible_keys),
+                    }
+                )
+        elif connection.vendor == "sqlite":
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())
+            for row in cursor.fetchall():
+                detail = row[-1]
+                plans.append(
+                    {
+                        "table": detail.split()[1] if len(detail.split()) > 1 else None,
+                        "type": detail,
+                        "key": None,
+                        "rows": None,
+                        "full_scan": detail.startswith("SCAN") and "USING" not in detail.upper(),
+                    }
+                )
+    return plans
+
+
+def advise(recorder, min_count=1):
+    """
+    对记录的查询形态执行 EXPLAIN 并给出索引建议
+
+    :param recorder:
+    :param min_count: 忽略出现次数小于该值的形态
+    :return: [{"table", "model", "soft_delete", "shape", "count", "plan", "full_scan", "suggest"}]
+    """
+    models = table_models()
+    patterns = {
+        table: re.compile(rf"\b(FROM|JOIN|UPDATE)\s+[`\"]?{re.escape(table)}([`\"]|\b)", re.I) for table in models
+    }
+    indexes = {}
+    report = []
+    for item in recorder.shapes.values():
+        if item["count"] < min_count:
+            continue
+
+        connection = connections[item["alias"]]
+        tables = [table for table, pattern in patterns.items() if pattern.search(item["sql"])]
+        if not tables:
+            continue
+        try:
+            plans = explain(connection, item["sql"], item["params"])
+        except Exception as e:  # noqa
+            plans = [{"table": None, "error": str(e), "full_scan": False}]
+
+        for table in tables:
+            model = models[table]
+            equal, ranges, ordering = query_columns(item["sql"], table)
+            columns = suggest_index(model, equal, ranges, ordering)
+            if columns is not None:
+                key = (item["alias"], table)
+                if key not in indexes:
+                    indexes[key] = existing_indexes(connection, table)
+                if covered(columns, indexes[key], model._meta.pk.column):
+                    columns = None
+
+            # JOIN 查询只看该表的执行计划
+            plan = [p for p in plans if p["table"] == table] or plans
+            report.append(
+                {
+                    "table": table,
+                    "model": model.__name__,
+                    "soft_delete": is_soft_delete(model),
+                    "shape": item["shape"],
+                    "count": item["count"],
+                    "plan": plan,
+                    "full_scan": any(p["full_scan"] for p in plan),
+                    "suggest": columns,
+                }
+            )
+    return report
+
+
+def summarize(report):
+    """
+    按表汇总建议索引
+
+    :return: {table: {columns: 出现次数}}
+    """
+    summary = defaultdict(lambda: defaultdict(int))
+    for row in report:
+        if row["suggest"]:
+            summary[row["table"]][row["suggest"]] += row["count"]
+    return summary
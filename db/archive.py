@@ -0,0 +1,147 @@
+import logging
+import time
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import connections, router, transaction
+
+from django_template.drf.models import SDBasicModel
+from utils.redisx import CurrencyLock
+
+logger = logging.getLogger("django")
+
+DAY_MS = 86400 * 1000
+
+
+def soft_delete_models():
+    """
+    所有非抽象的 SDBasicModel 子类
+    """
+    return [model for model in apps.get_models() if issubclass(model, SDBasicModel)]
+
+
+def archive_table(model):
+    return f"{model._meta.db_table}_archive"
+
+
+def ensure_archive_table(connection, model):
+    """
+    按原表结构创建归档表(已存在时跳过)
+    """
+    qn = connection.ops.quote_name
+    table, archive = qn(model._meta.db_table), qn(archive_table(model))
+    with connection.cursor() as cursor:
+        if connection.vendor == "mysql":
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {archive} LIKE {table}")
+        else:
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {archive} AS SELECT * FROM {table} WHERE 1 = 0")
+
+
+class Archiver:
+    """
+    把 delete_ts 早于 days 天前的行按主键顺序分批移动到 <table>_archive
+
+    每批在一个短事务内 INSERT ... SELECT + DELETE, 批之间 sleep 限流;
+    已处理到的主键记录在缓存中, 中断后再次执行从断点继续
+    """
+
+    def __init__(self, model, days=30, chunk_size=500, sleep=0.1, using=None, dry_run=False):
+        """
+        :param model: SDBasicModel 子类
+        :param days: 软删除超过多少天的行才归档
+        :param chunk_size: 每批行数
+        :param sleep: 每批之间的间隔(秒)
+        :param using: 数据库别名, 默认按 router 的写库
+        :param dry_run: 只统计不移动
+        """
+        self.model = model
+        self.days = days
+        self.chunk_size = chunk_size
+        self.sleep = sleep
+        self.using = using or router.db_for_write(model)
+        self.dry_run = dry_run
+        self.table = model._meta.db_table
+        self.cutoff = int(time.time() * 1000) - days * DAY_MS
+
+    @property
+    def checkpoint_key(self):
+        return f"archive:{self.using}:{self.table}"
+
+    def get_checkpoint(self):
+        return cache.get(self.checkpoint_key) or 0
+
+    def set_checkpoint(self, pk):
+        cache.set(self.checkpoint_key, pk, None)
+
+    def reset(self):
+        cache.delete(self.checkpoint_key)
+
+    def queryset(self):
+        return self.model.all_objects.using(self.using).filter(delete_ts__gt=0, delete_ts__lt=self.cutoff)
+
+    def pending(self):
+        return self.queryset().filter(pk__gt=self.get_checkpoint()).count()
+
+    def move(self, ids):
+        connection = connections[self.using]
+        qn = connection.ops.quote_name
+        columns = ", ".join(qn(field.column) for field in self.model._meta.concrete_fields)
+        pk = qn(self.model._meta.pk.column)
+        with transaction.atomic(using=self.using):
+            # 先锁住仍满足条件的行, 期间被恢复的行不会写入归档表
+            ids = list(self.queryset().filter(pk__in=ids).select_for_update().values_list("pk", flat=True))
+            if not ids:
+                return 0
+
+            placeholders = ", ".join(["%s"] * len(ids))
+            where = f"{pk} IN ({placeholders}) AND {qn('delete_ts')} > 0 AND {qn('delete_ts')} < %s"
+            params = [*ids, self.cutoff]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {qn(archive_table(self.model))} ({columns}) "
+                    f"SELECT {columns} FROM {qn(self.table)} WHERE {where}",
+                    params,
+                )
+                cursor.execute(f"DELETE FROM {qn(self.table)} WHERE {where}", params)
+                return cursor.rowcount
+
+    def run(self, max_chunks=0, progress=None):
+        """
+        :param max_chunks: 最多处理批数, 0 不限制
+        :param progress: 每批后的回调 progress(moved, last_pk, total)
+        :return: 移动的行数
+        """
+        if not self.dry_run:
+            ensure_archive_table(connections[self.using], self.model)
+
+        total = self.pending()
+        moved = chunks = 0
+        last_pk = self.get_checkpoint()
+        with CurrencyLock(f"cl:{self.checkpoint_key}", timeout=60, renew=True):
+            while not max_chunks or chunks < max_chunks:
+                ids = list(
+                    self.queryset()
+                    .filter(pk__gt=last_pk)
+                    .order_by("pk")
+                    .values_list("pk", flat=True)[: self.chunk_size]
+                )
+                if not ids:
+                    # 完整扫描结束, 清除断点, 下次从头扫描之后新软删除的行
+                    if not self.dry_run:
+                        self.reset()
+                    break
+
+                if not self.dry_run:
+                    moved += self.move(ids)
+                    self.set_checkpoint(ids[-1])
+                else:
+                    moved += len(ids)
+                last_pk = ids[-1]
+                chunks += 1
+
+                logger.info(f"archive {self.table}: {moved}/{total}, last pk {last_pk}")
+                if progress:
+                    progress(moved, last_pk, total)
+                if self.sleep:
+                    time.sleep(self.sleep)
+        return moved
@@ -0,0 +1,281 @@
+"""
+带连接池的 MySQL backend, ENGINE = "db.backends.mysql"
+
+DATABASES["xxx"]["POOL_OPTIONS"]:
+    POOL_SIZE: 常驻连接数
+    MAX_OVERFLOW: 超出 POOL_SIZE 后最多再创建的连接数, 归还时直接关闭
+    TIMEOUT: 连接耗尽时等待的秒数, 超时抛出 OperationalError
+    RECYCLE: 连接最长存活秒数, 超过后取出时重建
+    PRE_PING: 取出时 ping 检查, 失败则重建
+
+Django 关闭连接(请求结束、close_old_connections、close_db)时归还到池中, 而不是断开
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+import weakref
+
+from django.db.backends.mysql import base
+
+logger = logging.getLogger("django")
+
+Database = base.Database
+
+# (pid, alias) -> QueuePool, fork 后子进程使用自己的连接池
+_pools = {}
+_pools_lock = threading.Lock()
+
+# fork 继承自父进程的连接: 与父进程共用 socket, 不能使用也不能关闭, 保留引用避免被回收时断开
+_inherited = []
+
+
+def pool_stats():
+    """
+    当前进程各连接池指标, {alias: {...}}
+    """
+    pid = os.getpid()
+    return {alias: pool.stats() for (pool_pid, alias), pool in list(_pools.items()) if pool_pid == pid}
+
+
+class _PooledConnection:
+    """
+    代理 MySQLdb 连接, close() 时归还到连接池
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self.created_at = created_at
+        # 未 close() 就被回收(如所在线程退出)时归还名额
+        self._finalizer = weakref.finalize(self, pool.release_lost, raw)
+        self._finalizer.atexit = False
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get("_raw")
+        if raw is None:
+            raise Database.InterfaceError(0, "connection returned to pool")
+        return getattr(raw, name)
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._finalizer.detach()
+            self._pool.checkin(raw, self.created_at)
+
+
+class QueuePool:
+    def __init__(self, alias, creator, size=5, max_overflow=10, timeout=30, recycle=3600, pre_ping=True):
+        """
+        :param alias: 数据库别名
+        :param creator: 创建新连接 creator() -> MySQLdb 连接
+        :param size: 常驻连接数
+        :param max_overflow: 溢出连接数
+        :param timeout: 等待连接的超时时间(秒)
+        :param recycle: 连接最长存活时间(秒), None 不限制
+        :param pre_ping: 取出时是否 ping
+        """
+        self.alias = alias
+        self.pid = os.getpid()
+        self.creator = creator
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+
+        # 空闲连接 (raw, created_at), 后进先出, 使少量连接保持活跃
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._total = 0  # 已创建未关闭的连接数
+        self._metrics = {
+            "checkouts": 0,
+            "created": 0,
+            "closed": 0,
+            "recycled": 0,
+            "ping_failed": 0,
+            "timeouts": 0,
+            "wait_count": 0,  # 需要等待的次数
+            "wait_time": 0.0,  # 等待总时长(秒)
+            "wait_time_max": 0.0,
+            "overflow_peak": 0,
+        }
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics.update(
+                size=self.size,
+                max_overflow=self.max_overflow,
+                total=self._total,
+                idle=self._idle.qsize(),
+                in_use=self._total - self._idle.qsize(),
+                overflow=max(self._total - self.size, 0),
+            )
+        return metrics
+
+    def _incr(self, name, value=1):
+        with self._lock:
+            self._metrics[name] += value
+
+    def _create(self):
+        try:
+            raw = self.creator()
+        except Exception:
+            with self._lock:
+                self._total -= 1
+            raise
+        self._incr("created")
+        return raw, time.monotonic()
+
+    def _discard(self, raw):
+        with self._lock:
+            self._total -= 1
+            self._metrics["closed"] += 1
+        try:
+            raw.close()
+        except Exception:  # noqa
+            pass
+
+    def _reserve(self):
+        """
+        未达到上限时占用一个名额
+        """
+        with self._lock:
+            if self._total >= self.size + self.max_overflow:
+                return False
+            self._total += 1
+            overflow = self._total - self.size
+            if overflow > self._metrics["overflow_peak"]:
+                self._metrics["overflow_peak"] = overflow
+            return True
+
+    def _get(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        if self._reserve():
+            return self._create()
+
+        begin = time.monotonic()
+        try:
+            while True:
+                remaining = self.timeout - (time.monotonic() - begin)
+                if remaining <= 0:
+                    self._incr("timeouts")
+                    raise Database.OperationalError(
+                        2013,
+                        f"connection pool {self.alias} exhausted: "
+                        f"size {self.size}, overflow {self.max_overflow}, timeout {self.timeout}s",
+                    )
+                try:
+                    return self._idle.get(timeout=min(remaining, 0.05))
+                except queue.Empty:
+                    # 期间有连接被关闭, 空出名额
+                    if self._reserve():
+                        return self._create()
+        finally:
+            waited = time.monotonic() - begin
+            with self._lock:
+                self._metrics["wait_count"] += 1
+                self._metrics["wait_time"] += waited
+                self._metrics["wait_time_max"] = max(self._metrics["wait_time_max"], waited)
+
+    def _replace(self, raw):
+        """
+        关闭 raw 并在同一名额上新建连接
+        """
+        self._incr("closed")
+        try:
+            raw.close()
+        except Exception:  # noqa
+            pass
+        return self._create()
+
+    def checkout(self):
+        raw, created_at = self._get()
+        self._incr("checkouts")
+
+        if self.recycle is not None and time.monotonic() - created_at > self.recycle:
+            self._incr("recycled")
+            raw, created_at = self._replace(raw)
+        elif self.pre_ping:
+            try:
+                raw.ping()
+            except Exception:  # noqa
+                logger.warning(f"connection pool {self.alias}: ping failed, reconnect")
+                self._incr("ping_failed")
+                raw, created_at = self._replace(raw)
+
+        return _PooledConnection(self, raw, created_at)
+
+    def release_lost(self, raw):
+        """
+        连接未归还就被回收, 关闭并释放名额
+        """
+        if os.getpid() != self.pid:
+            _inherited.append(raw)
+            return
+        logger.warning(f"connection pool {self.alias}: connection garbage collected without close()")
+        self._discard(raw)
+
+    def checkin(self, raw, created_at):
+        if os.getpid() != self.pid:
+            # 父进程的连接, 丢弃且不发送任何数据
+            _inherited.append(raw)
+            return
+
+        # 重置事务状态, 失败说明连接已不可用
+        try:
+            raw.rollback()
+        except Exception:  # noqa
+            self._discard(raw)
+            return
+
+        if self._idle.qsize() >= self.size:
+            # 溢出连接归还时关闭
+            self._discard(raw)
+            return
+        self._idle.put((raw, created_at))
+
+    def dispose(self):
+        """
+        关闭所有空闲连接
+        """
+        while True:
+            try:
+                raw, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(raw)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    pooled = True
+
+    def get_pool(self, conn_params):
+        key = (os.getpid(), self.alias)
+        pool = _pools.get(key)
+        if pool is not None:
+            return pool
+
+        with _pools_lock:
+            if key not in _pools:
+                options = self.settings_dict.get("POOL_OPTIONS", {})
+                _pools[key] = QueuePool(
+                    self.alias,
+                    lambda: super(DatabaseWrapper, self).get_new_connection(conn_params),
+                    size=options.get("POOL_SIZE", 5),
+                    max_overflow=options.get("MAX_OVERFLOW", 10),
+                    timeout=options.get("TIMEOUT", 30),
+                    recycle=options.get("RECYCLE", 3600),
+                    pre_ping=options.get("PRE_PING", True),
+                )
+            return _pools[key]
+
+    def get_new_connection(self, conn_params):
+        return self.get_pool(conn_params).checkout()
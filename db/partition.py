@@ -0,0 +1,205 @@
+import logging
+import threading
+import time
+
+from django.db import connections, router
+from django.utils import timezone
+
+from django_template.drf.models import DynamicModel
+from utils.datetimex import day_begin, move_day, move_month, split_date_range
+
+logger = logging.getLogger("django")
+
+MONTH = "month"
+DAY = "day"
+
+_FORMATS = {MONTH: "%Y%m", DAY: "%Y%m%d"}
+
+# 已声明的分区, 供 partition_maintain 命令使用
+partitions = []
+
+
+class Partition:
+    """
+    按时间分表, 如 verify_code_202610
+
+    base_cls 为抽象模型, 实现 get_table_name(suffix), 如:
+
+        class VerifyCodeBase(BasicModel):
+            ...
+
+            class Meta:
+                abstract = True
+
+            @classmethod
+            def get_table_name(cls, suffix):
+                return f"verify_code_{suffix}"
+
+        verify_codes = Partition(VerifyCodeBase, template="verify_code")
+        verify_codes.ensure().objects.create(...)
+        verify_codes.read(start, lambda m: m.objects.filter(phone=phone).order_by("-id")[:1], limit=1)
+
+    写入通过 ensure() 定位到当前分区(不存在时按 template 建表), 读取只访问与查询时间窗重叠的已存在分区,
+    过期分区直接 DROP TABLE
+    """
+
+    def __init__(self, base_cls, template, period=MONTH, using=None, table_cache_timeout=60):
+        """
+        :param base_cls: 抽象模型
+        :param template: 建表模板表名, MySQL 下使用 CREATE TABLE ... LIKE template
+        :param period: MONTH / DAY
+        :param using: 数据库别名, 默认按 router 的写库
+        :param table_cache_timeout: 已存在分区列表的缓存时间(秒)
+        """
+        self.base_cls = base_cls
+        self.template = template
+        self.period = period
+        self.fmt = _FORMATS[period]
+        self._using = using
+        self.table_cache_timeout = table_cache_timeout
+        self._tables = None
+        self._tables_ts = 0
+        self._lock = threading.Lock()
+        partitions.append(self)
+
+    @property
+    def using(self):
+        return self._using or router.db_for_write(self.get_model(self.suffix()))
+
+    @staticmethod
+    def _local(dt):
+        """
+        转为本地时区的 naive datetime
+        """
+        if timezone.is_aware(dt):
+            dt = timezone.localtime(dt).replace(tzinfo=None)
+        return dt
+
+    def suffix(self, dt=None):
+        return self._local(dt or timezone.now()).strftime(self.fmt)
+
+    def get_model(self, suffix):
+        return DynamicModel(self.base_cls, suffix=suffix)
+
+    def model(self, dt=None):
+        """
+        dt 所在分区的 model, 默认当前时间
+        """
+        return self.get_model(self.suffix(dt))
+
+    def move(self, dt, n):
+        return move_month(dt, n) if self.period == MONTH else move_day(dt, n)
+
+    def tables(self, refresh=False):
+        """
+        已存在的分区表名
+        """
+        now = time.time()
+        if refresh or self._tables is None or now - self._tables_ts > self.table_cache_timeout:
+            prefix = self.base_cls.get_table_name(suffix="")
+            connection = connections[self.using]
+            with connection.cursor() as cursor:
+                names = connection.introspection.table_names(cursor)
+            self._tables = {name for name in names if name.startswith(prefix) and name[len(prefix) :].isdigit()}
+            self._tables_ts = now
+        return self._tables
+
+    def ensure(self, dt=None):
+        """
+        确保 dt 所在分区存在
+
+        :return: 分区 model
+        """
+        model = self.model(dt)
+        table = model._meta.db_table
+        if table in self.tables():
+            return model
+
+        with self._lock:
+            if table not in self.tables(refresh=True):
+                connection = connections[self.using]
+                if connection.vendor == "mysql":
+                    qn = connection.ops.quote_name
+                    with connection.cursor() as cursor:
+                        cursor.execute(f"CREATE TABLE IF NOT EXISTS {qn(table)} LIKE {qn(self.template)}")
+                else:
+                    with connection.schema_editor() as editor:
+                        editor.create_model(model)
+                self._tables.add(table)
+                logger.info(f"create partition {table}")
+        return model
+
+    def models(self, start, end=None):
+        """
+        与 [start, end] 重叠的已存在分区, 新的在前
+        """
+        start, end = self._local(start), self._local(end or timezone.now())
+        # 从 start 当天零点开始按天展开, 否则 end 当天可能被跳过
+        models = [self.get_model(suffix) for suffix in split_date_range(day_begin(start), end, self.fmt)]
+        tables = self.tables()
+        if models and models[-1]._meta.db_table not in tables:
+            # 最新分区可能刚由其他进程创建, 缓存中还没有
+            tables = self.tables(refresh=True)
+        return [model for model in reversed(models) if model._meta.db_table in tables]
+
+    def read(self, start, fn, end=None, limit=None):
+        """
+        从新到旧依次查询重叠的分区, 凑够 limit 条后停止
+
+        :param start: 查询时间窗开始
+        :param fn: fn(model) -> 结果, 每个分区内按时间倒序
+        :param end: 查询时间窗结束, 默认当前时间
+        :param limit:
+        :return:
+        """
+        result = []
+        for model in self.models(start, end):
+            result.extend(fn(model))
+            if limit and len(result) >= limit:
+                return result[:limit]
+        return result
+
+    def drop(self, keep, dry_run=False):
+        """
+        删除 keep 个周期之前的分区
+
+        :param keep: 保留的周期数(含当前), 至少为 1
+        :param dry_run:
+        :return: 删除的表名
+        """
+        if keep < 1:
+            # keep=0 时 cutoff 为下个周期, 会删除当前正在写入的分区
+            raise ValueError(f"keep must be >= 1, got {keep}")
+        cutoff = self.suffix(self.move(timezone.now(), -(keep - 1)))
+        prefix = self.base_cls.get_table_name(suffix="")
+        tables = sorted(t for t in self.tables(refresh=True) if t[len(prefix) :] < cutoff)
+        if dry_run or not tables:
+            return tables
+
+        connection = connections[self.using]
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute(f"DROP TABLE IF EXISTS {qn(table)}")
+                logger.info(f"drop partition {table}")
+        self.tables(refresh=True)
+        return tables
+
+    def maintain(self, keep, ahead=1, dry_run=False):
+        """
+        预建之后 ahead 个周期的分区并删除过期分区
+
+        :return: (新建的表名, 删除的表名)
+        """
+        if keep < 1:
+            raise ValueError(f"keep must be >= 1, got {keep}")
+        created = []
+        now = timezone.now()
+        for n in range(ahead + 1):
+            dt = self.move(now, n)
+            table = self.model(dt)._meta.db_table
+            if table not in self.tables():
+                created.append(table)
+                if not dry_run:
+                    self.ensure(dt)
+        return created, self.drop(keep, dry_run)
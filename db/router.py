@@ -1,3 +1,19 @@
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django import db
+from django.conf import settings
+from django.db import connections
+
+from db.sharding import get_shard
+
+logger = logging.getLogger("django")
+
+
 class OtherRouter:
     """
     A router to control all database operations on models in the
@@ -39,3 +55,286 @@ class OtherRouter:
         if app_label in self.route_app_labels:
             return db == "other"
         return None
+
+
+class ShardRouter:
+    """
+    分表 model 路由到 Sharding.databases 中对应的库, 未配置 databases 时交给后续 router
+    """
+
+    def _db_for_shard(self, model):
+        shard = get_shard(model)
+        if shard is None:
+            return None
+        sharding, index = shard
+        return sharding.database(index)
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_shard(model)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_shard(model)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        db1, db2 = self._db_for_shard(type(obj1)), self._db_for_shard(type(obj2))
+        if db1 and db2:
+            return db1 == db2
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        model = hints.get("model")
+        if model is None:
+            return None
+        database = self._db_for_shard(model)
+        if database is None:
+            return None
+        return db == database
+
+
+# 读写分离, 见 settings.READ_WRITE_SPLIT
+ROUND_ROBIN = "round_robin"
+LEAST_CONNECTIONS = "least_connections"
+
+# 写入后在该时间点(time.monotonic())之前读主库
+_pin_until = contextvars.ContextVar("db_pin_until", default=0.0)
+
+
+def pin_primary(seconds=None):
+    """
+    之后 seconds 秒内的读走主库(read-your-writes)
+    """
+    seconds = _config()["PIN_SECONDS"] if seconds is None else seconds
+    _pin_until.set(max(_pin_until.get(), time.monotonic() + seconds))
+
+
+def is_pinned():
+    return _pin_until.get() > time.monotonic()
+
+
+def reset_pin():
+    """
+    :return: token, 供 _pin_until.reset 使用
+    """
+    return _pin_until.set(0.0)
+
+
+def _config():
+    config = {
+        "PRIMARY": "default",
+        "REPLICAS": [],
+        "STRATEGY": ROUND_ROBIN,
+        "MAX_LAG": 5,
+        "LAG_CHECK_INTERVAL": 5,
+        "PIN_SECONDS": 3,
+        "PIN_COOKIE": "db_pin",
+    }
+    config.update(getattr(settings, "READ_WRITE_SPLIT", {}))
+    return config
+
+
+class _Metrics:
+    """
+    路由计数及从库延迟
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.active = defaultdict(int)  # 各库正在执行的查询数
+        self.lag = {}
+        self.ejected = set()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def execute_wrapper(self, alias):
+        def wrapper(execute, sql, params, many, context):
+            with self._lock:
+                self.active[alias] += 1
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                with self._lock:
+                    self.active[alias] -= 1
+
+        return wrapper
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "active": dict(self.active),
+                "lag": dict(self.lag),
+                "ejected": sorted(self.ejected),
+            }
+
+
+metrics = _Metrics()
+
+
+def routing_stats():
+    """
+    路由指标: counters(read:<alias>/write:<alias>/read_pinned/read_fallback/eject:<alias>/restore:<alias>),
+    active(各库正在执行的查询数), lag(从库延迟秒数, None 为复制中断), ejected(被摘除的从库)
+    """
+    return metrics.snapshot()
+
+
+def _track_active(alias):
+    """
+    统计 alias 在当前线程连接上正在执行的查询数, 用于 least_connections
+    """
+    connection = connections[alias]
+    if not getattr(connection, "_track_active", False):
+        connection.execute_wrappers.append(metrics.execute_wrapper(alias))
+        connection._track_active = True
+
+
+def replica_lag(alias):
+    """
+    从库复制延迟(秒), 复制中断返回 None; 非 MySQL 返回 0
+    """
+    connection = connections[alias]
+    if connection.vendor != "mysql":
+        return 0
+
+    with connection.cursor() as cursor:
+        for sql, column in (
+            ("SHOW REPLICA STATUS", "Seconds_Behind_Source"),
+            ("SHOW SLAVE STATUS", "Seconds_Behind_Master"),
+        ):
+            try:
+                cursor.execute(sql)
+            except Exception:  # noqa MySQL < 8.0.22
+                continue
+            row = cursor.fetchone()
+            if row is None:
+                # 不是从库
+                return 0
+            columns = [col[0] for col in cursor.description]
+            return row[columns.index(column)]
+    return None
+
+
+class _LagChecker:
+    """
+    后台线程定期检查从库延迟, 超过 MAX_LAG 或复制中断时摘除, 恢复后加回
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def ensure(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run, name="db-lag-checker", daemon=True)
+                self._thread.start()
+
+    def check(self):
+        config = _config()
+        for alias in config["REPLICAS"]:
+            try:
+                lag = replica_lag(alias)
+            except Exception:  # noqa
+                logger.warning(f"check replica lag failed: {alias}", exc_info=True)
+                lag = None
+
+            healthy = lag is not None and lag <= config["MAX_LAG"]
+            with metrics._lock:
+                metrics.lag[alias] = lag
+                ejected = alias in metrics.ejected
+                if healthy and ejected:
+                    metrics.ejected.discard(alias)
+                elif not healthy and not ejected:
+                    metrics.ejected.add(alias)
+            if healthy and ejected:
+                metrics.incr(f"restore:{alias}")
+                logger.info(f"replica restored: {alias}, lag {lag}")
+            elif not healthy and not ejected:
+                metrics.incr(f"eject:{alias}")
+                logger.warning(f"replica ejected: {alias}, lag {lag}")
+
+    def run(self):
+        while True:
+            try:
+                self.check()
+            finally:
+                db.close_old_connections()
+            time.sleep(_config()["LAG_CHECK_INTERVAL"])
+
+
+_lag_checker = _LagChecker()
+
+
+class ReplicaRouter:
+    """
+    读写分离: 写入走主库, 读取按 STRATEGY 分配到未被摘除的从库
+
+    - 写入后 PIN_SECONDS 秒内同一上下文的读走主库, 配合 ReadYourWritesMiddleware 可跨请求
+    - 主库事务内的读走主库
+    - 没有可用从库时读主库
+    放在 DATABASE_ROUTERS 的最后, 只处理其他 router 未路由的 model
+    """
+
+    def __init__(self):
+        config = _config()
+        self.primary = config["PRIMARY"]
+        self.replicas = list(config["REPLICAS"])
+        self.strategy = config["STRATEGY"]
+        self._cycle = itertools.cycle(self.replicas)
+        self._lock = threading.Lock()
+        if self.replicas:
+            _lag_checker.ensure()
+
+    def _choose(self):
+        available = [alias for alias in self.replicas if alias not in metrics.ejected]
+        if not available:
+            return None
+        if self.strategy == LEAST_CONNECTIONS:
+            # 同步查询很短, 多数时候各从库都是 0, 并列时按轮询选择
+            least = min(metrics.active[alias] for alias in available)
+            available = [alias for alias in available if metrics.active[alias] == least]
+
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                alias = next(self._cycle)
+                if alias in available:
+                    return alias
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas:
+            return None
+        if is_pinned() or connections[self.primary].in_atomic_block:
+            # 主库事务内的读取(如 ATOMIC_REQUESTS 的视图)读到的旧数据会随 save() 写回
+            metrics.incr("read_pinned")
+            return self.primary
+
+        alias = self._choose()
+        if alias is None:
+            metrics.incr("read_fallback")
+            return self.primary
+        metrics.incr(f"read:{alias}")
+        _track_active(alias)
+        return alias
+
+    def db_for_write(self, model, **hints):
+        if not self.replicas:
+            return None
+        pin_primary()
+        metrics.incr(f"write:{self.primary}")
+        return self.primary
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {self.primary, *self.replicas}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in self.replicas:
+            return False
+        return None
@@ -0,0 +1,141 @@
+import heapq
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django_template.drf.models import DynamicModel, close_db
+
+# 分表 model -> (Sharding, 分片序号)
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def shard_key(value, shards):
+    """
+    分片序号, 整数取模, 其他值取 crc32 后取模(不使用 hash(), 进程间不稳定)
+
+    :param value: 分片键的值, 如 account_id
+    :param shards: 分片数
+    :return:
+    """
+    if isinstance(value, int):
+        return value % shards
+    return zlib.crc32(str(value).encode()) % shards
+
+
+def get_shard(model):
+    """
+    :return: (Sharding, 分片序号), 非分表 model 返回 None
+    """
+    return _registry.get(model)
+
+
+class Sharding:
+    """
+    哈希分表
+
+    base_cls 为抽象模型, 实现 get_table_name(index), 如:
+
+        class OrderBase(BasicModel):
+            account_id = models.IntegerField()
+
+            class Meta:
+                abstract = True
+
+            @classmethod
+            def get_table_name(cls, index):
+                return f"order_{index}"
+
+        orders = Sharding(OrderBase, shards=16, key="account_id")
+        orders.model(account_id).objects.filter(account_id=account_id)
+        orders.merge(lambda m: m.objects.order_by("-id")[:20], key=attrgetter("id"), reverse=True, limit=20)
+
+    写入和单键读取通过 model() 定位到分表, 分表所在的库由 db.router.ShardRouter 按 databases 路由
+    """
+
+    def __init__(self, base_cls, shards, key="account_id", databases=None, func=shard_key, max_workers=8):
+        """
+        :param base_cls: 抽象模型
+        :param shards: 分片数
+        :param key: 分片键字段名
+        :param databases: 数据库别名列表, 分片 i 位于 databases[i % len(databases)], None 为默认路由
+        :param func: 分片函数 func(value, shards) -> 序号
+        :param max_workers: 跨分片查询的并发数
+        """
+        self.base_cls = base_cls
+        self.shards = shards
+        self.key = key
+        self.databases = databases
+        self.func = func
+        self.max_workers = max_workers
+        self._models = {}
+
+    def index(self, value):
+        return self.func(value, self.shards)
+
+    def database(self, index):
+        if not self.databases:
+            return None
+        return self.databases[index % len(self.databases)]
+
+    def get_model(self, index):
+        """
+        第 index 个分表的 model
+        """
+        model = self._models.get(index)
+        if model is None:
+            model = DynamicModel(self.base_cls, index=index)
+            with _registry_lock:
+                _registry[model] = (self, index)
+                self._models[index] = model
+        return model
+
+    def model(self, value):
+        """
+        分片键的值对应的分表 model
+        """
+        return self.get_model(self.index(value))
+
+    def for_instance(self, **values):
+        """
+        按分片键创建实例, orders.for_instance(account_id=1, ...)
+        """
+        return self.model(values[self.key])(**values)
+
+    def models(self):
+        return [self.get_model(index) for index in range(self.shards)]
+
+    def fan_out(self, fn, shards=None):
+        """
+        在线程池中对各分表执行 fn(model), 按分片序号返回结果
+
+        :param fn: fn(model) -> 结果, 返回 queryset 时会在工作线程中求值
+        :param shards: 分片序号, 默认全部
+        :return:
+        """
+
+        @close_db
+        def run(model):
+            return list(fn(model))
+
+        models = [self.get_model(index) for index in (range(self.shards) if shards is None else shards)]
+        if len(models) == 1:
+            return [run(models[0])]
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(models))) as executor:
+            return list(executor.map(run, models))
+
+    def merge(self, fn, key, reverse=False, limit=None, shards=None):
+        """
+        跨分片有序查询, 各分表结果需按相同的 key 排序, 归并后取前 limit 条
+
+        :param fn: fn(model) -> 有序结果
+        :param key: 排序键函数
+        :param reverse: 是否降序
+        :param limit:
+        :param shards:
+        :return:
+        """
+        merged = heapq.merge(*self.fan_out(fn, shards), key=key, reverse=reverse)
+        return list(islice(merged, limit))
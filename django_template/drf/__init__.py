@@ -1,16 +1,31 @@
 import logging
 import time
 
+from django.http import HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
 from rest_framework.response import Response
 
 logger = logging.getLogger("django")
 
 
 class APIException(Exception):
-    def __init__(self, msg="非法请求", code=40000, status=400):
+    def __init__(self, msg="非法请求", code=40000, status=400, headers=None):
         self.msg = msg
         self.code = code
         self.status = status
+        self.headers = headers
+
+
+def envelope(data=None, code=0, msg=""):
+    """
+    统一返回格式 {data, msg, code, ts}
+    """
+    return {
+        "data": data,
+        "msg": msg,
+        "code": code,
+        "ts": int(time.time() * 1000),
+    }
 
 
 class JSONResponse(Response):
@@ -27,12 +42,7 @@ class JSONResponse(Response):
     ):
         super().__init__(data, status, template_name, headers, exception, content_type)
 
-        self.data = {
-            "data": data,
-            "msg": msg,
-            "code": code,
-            "ts": int(time.time() * 1000),
-        }
+        self.data = envelope(data, code, msg)
 
 
 def logging_print(func):
@@ -62,3 +72,60 @@ class DynamicSerializerMixin:
             existing = set(self.fields)
             for field_name in existing - allowed:
                 self.fields.pop(field_name)
+
+
+class _NotModified(Exception):
+    pass
+
+
+class ConditionalGetMixin:
+    """
+    条件请求: GET 时先调用 get_version, 资源未变化则直接返回 304, 不执行 get
+
+    get_version 返回毫秒时间戳(如 BasicModel.get_version), 返回 None 不做处理
+    """
+
+    def get_version(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        self._version = None
+        if request.method not in ("GET", "HEAD"):
+            return
+        self._version = version = self.get_version(request, *args, **kwargs)
+        if version is None:
+            return
+
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if if_none_match:
+            # 弱比较, 压缩中间件会把 ETag 改为 W/
+            etags = {etag.removeprefix("W/") for etag in parse_etags(if_none_match)}
+            if "*" in etags or self._etag(version) in etags:
+                raise _NotModified
+            return
+
+        if_modified_since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+        if if_modified_since is not None and version // 1000 <= if_modified_since:
+            raise _NotModified
+
+    @staticmethod
+    def _etag(version):
+        return '"%x"' % version
+
+    def _set_validators(self, response):
+        response.headers["ETag"] = self._etag(self._version)
+        response.headers["Last-Modified"] = http_date(self._version // 1000)
+        return response
+
+    def handle_exception(self, exc):
+        if isinstance(exc, _NotModified):
+            return self._set_validators(HttpResponseNotModified())
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, "_version", None) is not None and response.status_code == 200:
+            self._set_validators(response)
+        return response
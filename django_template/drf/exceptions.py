@@ -53,7 +53,7 @@ def exception_handler(exc, context):
     if response is None:
         set_rollback()
         if isinstance(exc, APIException):
-            return JSONResponse(code=exc.code, msg=exc.msg, status=exc.status)
+            return JSONResponse(code=exc.code, msg=exc.msg, status=exc.status, headers=exc.headers)
         else:
             logger.error("err", exc_info=True)
             return JSONResponse(code=50000, msg="服务器错误", status=500)
@@ -1,9 +1,17 @@
+import gzip
 import logging
+import math
+import threading
 import time
-from functools import wraps
+import zlib
+from functools import partial, wraps
 
 from django import db
-from django.db import models
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.utils.cache import patch_vary_headers
 
 logger = logging.getLogger("django")
 
@@ -12,14 +20,73 @@ class BasicModel(models.Model):
     """
     创建更新时间
 
+    version_fields: 保存时(事务提交后)按这些字段缓存 update_ts 版本号, 用于条件请求(ETag/Last-Modified)
+        queryset.update() 不会更新版本号, 需要时调用 bump_version
     """
 
     create_ts = models.DateTimeField(auto_now_add=True)
     update_ts = models.DateTimeField(auto_now=True)
 
+    version_fields = ()
+    version_timeout = 86400
+
     class Meta:
         abstract = True
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if self.version_fields:
+            version = int(self.update_ts.timestamp() * 1000)
+            # 事务提交后再更新版本号, 避免并发读取到新版本号和未提交的旧数据; 回滚时不更新
+            for field in self.version_fields:
+                transaction.on_commit(
+                    partial(self.bump_version, version, **{field: getattr(self, field)}),
+                    using=self._state.db,
+                )
+
+    @classmethod
+    def _version_key(cls, **lookup):
+        ((field, value),) = lookup.items()
+        return f"ver:{cls._meta.db_table}:{field}:{value}"
+
+    @classmethod
+    def bump_version(cls, version=None, **lookup):
+        """
+        :param version: 毫秒时间戳, None 时删除缓存, 下次从数据库读取
+        :param lookup: version_fields 中的一个字段, 如 account_id=1
+        """
+        key = cls._version_key(**lookup)
+        try:
+            if version is None:
+                cache.delete(key)
+            else:
+                cache.set(key, version, cls.version_timeout)
+        except Exception:  # noqa
+            logger.warning(f"bump version failed: {key}", exc_info=True)
+
+    @classmethod
+    def get_version(cls, **lookup):
+        """
+        最近一次更新的毫秒时间戳, 优先读缓存; 没有数据时为 0
+        """
+        key = cls._version_key(**lookup)
+        try:
+            version = cache.get(key)
+        except Exception:  # noqa
+            logger.warning(f"get version failed: {key}", exc_info=True)
+            version = None
+        if version is not None:
+            return version
+
+        update_ts = cls.objects.filter(**lookup).order_by("-update_ts").values_list("update_ts", flat=True).first()
+        version = int(update_ts.timestamp() * 1000) if update_ts else 0
+        try:
+            # add 而不是 set: 期间提交的 bump_version 写入的新版本号不会被覆盖
+            cache.add(key, version, cls.version_timeout)
+        except Exception:  # noqa
+            logger.warning(f"set version failed: {key}", exc_info=True)
+        return version
+
 
 class _SoftDeleteQuerySet(models.QuerySet):
     def delete(self):
@@ -37,18 +104,90 @@ class _SoftDeleteManager(models.Manager):
         return qs
 
 
+class Cascade:
+    """
+    级联软删除声明
+
+    :param model: model 或 "app_label.Model"
+    :param field: 关联字段, 值为被删除行的主键
+    :param values: 更新的字段值, 默认 {"delete_ts": 被删除行的 delete_ts}; 非软删除表需指定
+    :param filters: 额外的过滤条件
+    """
+
+    def __init__(self, model, field, values=None, filters=None):
+        self._model = model
+        self.field = field
+        self.values = values
+        self.filters = filters or {}
+
+    @property
+    def model(self):
+        if isinstance(self._model, str):
+            self._model = apps.get_model(self._model)
+        return self._model
+
+    def run(self, pk, delete_ts, using=None, chunk_size=500):
+        """
+        按主键分批 UPDATE
+
+        :return: 更新的行数
+        """
+        model = self.model
+        values = self.values or {"delete_ts": delete_ts}
+        manager = model.objects if self.values else model.all_objects
+        queryset = manager.using(using).filter(**{self.field: pk}, **self.filters)
+        if not self.values:
+            queryset = queryset.filter(delete_ts=0)
+
+        total = last_pk = 0
+        while True:
+            ids = list(queryset.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:chunk_size])
+            if not ids:
+                break
+            total += queryset.filter(pk__in=ids).update(**values)
+            last_pk = ids[-1]
+
+        # queryset.update() 不会更新版本号, 提交后清除缓存的版本号
+        if self.field in getattr(model, "version_fields", ()):
+            transaction.on_commit(partial(model.bump_version, **{self.field: pk}), using=queryset.db)
+        return total
+
+
 class _SoftDeleteModel(models.Model):
     delete_ts = models.BigIntegerField(default=0)
 
     objects = _SoftDeleteManager()
     all_objects = models.Manager()
 
+    # 级联软删除的关联表, (Cascade(...), ...)
+    soft_delete_cascade = ()
+    cascade_chunk_size = 500
+
     class Meta:
         abstract = True
 
-    def delete(self, using=None, keep_parents=False):
+    def delete(self, using=None, keep_parents=False, cascade=True):
+        """
+        :param cascade: 是否同步级联软删除; 关联数据较多时传 False 并异步调用 cascade_delete
+        """
         self.delete_ts = int(time.time() * 1000)
         self.save(update_fields=["delete_ts"])
+        if cascade:
+            self.cascade_delete(self.pk, self.delete_ts, using)
+
+    @classmethod
+    def cascade_delete(cls, pk, delete_ts, using=None):
+        """
+        按 soft_delete_cascade 软删除关联数据, 关联行使用相同的 delete_ts
+
+        :return: {db_table: 更新的行数}
+        """
+        result = {}
+        for cascade in cls.soft_delete_cascade:
+            count = cascade.run(pk, delete_ts, using, cls.cascade_chunk_size)
+            result[cascade.model._meta.db_table] = count
+        logger.info(f"cascade delete {cls._meta.db_table}:{pk} {result}")
+        return result
 
     def hard_delete(self, using=None, keep_parents=False):
         return super().delete(using, keep_parents)
@@ -72,6 +211,10 @@ def close_db(func):
             return func(*args, **kwargs)
         finally:
             db.close_old_connections()
+            # 连接池(db.backends.mysql)的连接在结束时归还, 不在线程中长期占用
+            for connection in db.connections.all(initialized_only=True):
+                if getattr(connection, "pooled", False) and not connection.in_atomic_block:
+                    connection.close()
 
     return func_wrapper
 
@@ -93,33 +236,275 @@ class LoggingRequestMiddleware:
         response = self.get_response(request)
 
         t = int((time.time() - t0) * 1000)
-        logger.info(f"request: {request.get_full_path()} {t} ms")
+        stats = getattr(request, "compression", None)
+        if stats:
+            logger.info(
+                f"request: {request.get_full_path()} {t} ms "
+                f"{stats['encoding']} ratio={stats['ratio']:.2f} cpu={stats['cpu_ms']:.2f} ms"
+            )
+        else:
+            logger.info(f"request: {request.get_full_path()} {t} ms")
         return response
 
 
+class ReadYourWritesMiddleware:
+    """
+    读写分离(db.router.ReplicaRouter)下的 read-your-writes:
+    每个请求重置读主库标记; 请求中有写入时下发 cookie, 有效期内该客户端的读请求走主库
+
+    """
+
+    def __init__(self, get_response):
+        from db import router
+
+        self.router = router
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = self.router._config()
+        cookie = config["PIN_COOKIE"]
+        token = self.router.reset_pin()
+        try:
+            if request.COOKIES.get(cookie):
+                self.router.pin_primary()
+            pin_until = self.router._pin_until.get()
+
+            response = self.get_response(request)
+
+            # 本请求内发生写入
+            if self.router._pin_until.get() > pin_until:
+                response.set_cookie(cookie, "1", max_age=math.ceil(config["PIN_SECONDS"]), httponly=True)
+            return response
+        finally:
+            self.router._pin_until.reset(token)
+
+
+class _GzipCodec:
+    name = "gzip"
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def stream(self):
+        c = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return lambda chunk: c.compress(chunk) + c.flush(zlib.Z_SYNC_FLUSH), c.flush
+
+
+class _BrotliCodec:
+    name = "br"
+
+    def __init__(self, level):
+        import brotli
+
+        self._brotli = brotli
+        self.level = level
+
+    def compress(self, data):
+        return self._brotli.compress(data, quality=self.level)
+
+    def stream(self):
+        c = self._brotli.Compressor(quality=self.level)
+        return lambda chunk: c.process(chunk) + c.flush(), c.finish
+
+
+class _ZstdCodec:
+    name = "zstd"
+
+    def __init__(self, level):
+        import zstandard
+
+        self._zstd = zstandard
+        self._cctx = zstandard.ZstdCompressor(level=level)
+
+    def compress(self, data):
+        return self._cctx.compress(data)
+
+    def stream(self):
+        c = self._cctx.compressobj()
+        return lambda chunk: c.compress(chunk) + c.flush(self._zstd.COMPRESSOBJ_FLUSH_BLOCK), c.flush
+
+
+class CompressionMiddleware:
+    """
+    响应压缩, 按 Accept-Encoding 协商 zstd/br/gzip, 支持流式响应
+
+    settings.COMPRESSION:
+        ENCODINGS: 服务端偏好顺序, 未安装 zstandard/brotli 时自动跳过
+        LEVEL: 各编码的压缩级别
+        MIN_SIZE: 小于该字节数的响应不压缩
+        EXCLUDE_PATHS: 不压缩的路径前缀
+    放在 LoggingRequestMiddleware 之后, 压缩率和耗时会打印到请求日志中
+    """
+
+    CODECS = {"gzip": _GzipCodec, "br": _BrotliCodec, "zstd": _ZstdCodec}
+    COMPRESSIBLE_TYPES = (
+        "text/",
+        "application/json",
+        "application/javascript",
+        "application/xml",
+        "application/msgpack",
+        "application/cbor",
+    )
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        conf = getattr(settings, "COMPRESSION", {})
+        self.min_size = conf.get("MIN_SIZE", 512)
+        self.exclude_paths = tuple(conf.get("EXCLUDE_PATHS", ("/docs", "/schema", "/redoc", "/static")))
+        levels = {"gzip": 6, "br": 4, "zstd": 3, **conf.get("LEVEL", {})}
+
+        self.codecs = {}
+        for name in conf.get("ENCODINGS", ("zstd", "br", "gzip")):
+            try:
+                self.codecs[name] = self.CODECS[name](levels[name])
+            except ImportError:
+                logger.info(f"compression: {name} not available")
+
+    def negotiate(self, accept_encoding):
+        """
+        按 q 值选择编码, q 相同时按服务端偏好
+        """
+        accepted = {}
+        for item in accept_encoding.split(","):
+            name, _, params = item.strip().partition(";")
+            q = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    q = float(params[2:])
+                except ValueError:
+                    q = 0
+            accepted[name.strip().lower()] = q
+
+        best, best_q = None, 0
+        for name in self.codecs:
+            q = accepted.get(name, accepted.get("*", 0))
+            if q > best_q:
+                best, best_q = name, q
+        return best
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if (
+            response.has_header("Content-Encoding")
+            or response.status_code in (204, 304)
+            or request.path.startswith(self.exclude_paths)
+            or not response.get("Content-Type", "").startswith(self.COMPRESSIBLE_TYPES)
+        ):
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        name = self.negotiate(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if name is None:
+            return response
+        codec = self.codecs[name]
+
+        if response.streaming:
+            # 同 GZipMiddleware, ASGI 下的异步迭代器需要异步压缩
+            compress_stream = self.acompress_stream if response.is_async else self.compress_stream
+            response.streaming_content = compress_stream(request, codec, response.streaming_content)
+            del response.headers["Content-Length"]
+        else:
+            t0 = time.thread_time()
+            content = codec.compress(response.content)
+            cpu_ms = (time.thread_time() - t0) * 1000
+            if len(content) >= len(response.content):
+                return response
+            request.compression = {
+                "encoding": name,
+                "ratio": len(response.content) / len(content),
+                "cpu_ms": cpu_ms,
+            }
+            response.content = content
+            response.headers["Content-Length"] = str(len(content))
+
+        # 同 GZipMiddleware, 内容变化后 ETag 改为弱校验
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = name
+        return response
+
+    @staticmethod
+    def stream_compressor(request, codec):
+        """
+        :return: (feed(chunk) -> bytes, finish() -> bytes), finish 时打印压缩率和耗时
+        """
+        compress, flush = codec.stream()
+        stats = {"raw": 0, "size": 0, "cpu": 0.0}
+
+        def feed(chunk):
+            t0 = time.thread_time()
+            data = compress(chunk)
+            stats["cpu"] += time.thread_time() - t0
+            stats["raw"] += len(chunk)
+            stats["size"] += len(data)
+            return data
+
+        def finish():
+            data = flush()
+            stats["size"] += len(data)
+            logger.info(
+                f"request: {request.get_full_path()} stream {codec.name} "
+                f"ratio={stats['raw'] / max(stats['size'], 1):.2f} cpu={stats['cpu'] * 1000:.2f} ms"
+            )
+            return data
+
+        return feed, finish
+
+    def compress_stream(self, request, codec, streaming_content):
+        feed, finish = self.stream_compressor(request, codec)
+        for chunk in streaming_content:
+            data = feed(chunk)
+            if data:
+                yield data
+        yield finish()
+
+    async def acompress_stream(self, request, codec, streaming_content):
+        feed, finish = self.stream_compressor(request, codec)
+        async for chunk in streaming_content:
+            data = feed(chunk)
+            if data:
+                yield data
+        yield finish()
+
+
 class DynamicModel:
     """
-    动态模型
+    动态模型, base_cls 为抽象模型并实现 get_table_name(**kwargs)
 
     """
 
     _instance = {}
+    _lock = threading.Lock()
 
     def __new__(cls, base_cls, **kwargs):
         table_name = base_cls.get_table_name(**kwargs)
         new_cls_name = "".join(map(lambda x: x.capitalize(), table_name.split("_")))
 
-        if new_cls_name not in cls._instance:
-            meta_cls = base_cls.Meta
-            meta_cls.db_table = table_name
-            model_cls = type(
-                new_cls_name,
-                (base_cls,),
-                {
-                    "Meta": meta_cls,
-                    "__module__": cls.__module__,
-                },
-            )
-            cls._instance[new_cls_name] = model_cls
+        model_cls = cls._instance.get(new_cls_name)
+        if model_cls is not None:
+            return model_cls
+
+        with cls._lock:
+            if new_cls_name not in cls._instance:
+                # 继承而不是修改 base_cls.Meta, 否则各分表会互相覆盖 db_table
+                bases = (base_cls.Meta,) if hasattr(base_cls, "Meta") else ()
+                meta_cls = type("Meta", bases, {"db_table": table_name})
+                cls._instance[new_cls_name] = type(
+                    new_cls_name,
+                    (base_cls,),
+                    {
+                        "Meta": meta_cls,
+                        "__module__": base_cls.__module__,
+                    },
+                )
 
         return cls._instance[new_cls_name]
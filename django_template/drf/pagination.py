@@ -1,12 +1,64 @@
-import base64
-from urllib.parse import parse_qsl, urlencode
+import datetime
+import decimal
+import logging
+import uuid
+from functools import cached_property, partial
 
+from django.core import signing
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, PageNotAnInteger
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
 from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import CursorPagination, PageNumberPagination
 from rest_framework.response import Response
 
+from utils.tools import md5, namedtuple_fetchall
+
+logger = logging.getLogger("django")
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {"d": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"D": value.isoformat()}
+    if isinstance(value, decimal.Decimal):
+        return {"n": str(value)}
+    if isinstance(value, uuid.UUID):
+        return {"u": value.hex}
+    return value
+
+
+def _decode_value(value):
+    if not isinstance(value, dict):
+        return value
+    ((tag, raw),) = value.items()
+    if tag == "d":
+        return datetime.datetime.fromisoformat(raw)
+    if tag == "D":
+        return datetime.date.fromisoformat(raw)
+    if tag == "n":
+        return decimal.Decimal(raw)
+    if tag == "u":
+        return uuid.UUID(raw)
+    raise ValueError(tag)
+
 
 class CursorPagination(CursorPagination):
+    """
+    keyset 分页
+
+    排序字段末尾自动追加主键保证唯一, 过滤条件为 (a, b, id) > (x, y, z) 的 OR 展开:
+        a >= x AND (a > x OR (a = x AND b > y) OR (a = x AND b = y AND id > z))
+    首项的范围条件便于数据库使用联合索引 (a, b, id) 做范围扫描
+
+    游标为签名后的 [方向, 排序字段的值], 防止篡改
+
+    view.get_filtering 或 filtering 自定义的过滤条件不区分方向, 此时只支持向后翻页, 不返回 previous
+    """
+
     page_size = 20
 
     filtering = None
@@ -16,88 +68,105 @@ class CursorPagination(CursorPagination):
 
     max_page_size = None
 
+    cursor_salt = "django_template.drf.pagination.CursorPagination"
+
+    NEXT = "n"
+    PREVIOUS = "p"
+
     def paginate_queryset(self, queryset, request, view=None):
         page_size = self.get_page_size(request)
         if not page_size:
             return None
 
-        kwargs = self.decode_cursor(request) or {}
-
         self.ordering = self.get_ordering(request, queryset, view)
 
-        filtering = self.get_filtering(request, queryset, view, **kwargs)
+        direction, kwargs = self.decode_cursor(request) or (self.NEXT, {})
+        custom = self.has_custom_filtering(view)
+        reverse = direction == self.PREVIOUS and not custom
+
+        filtering = self.get_filtering(request, queryset, view, reverse=reverse, **kwargs)
         if filtering:
             queryset = queryset.filter(filtering)
 
-        queryset = queryset.order_by(*self.ordering)
+        ordering = self._reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
         results = list(queryset[: page_size + 1])
-        if len(results) < page_size + 1:
-            self.next = None
-            self.page = results
-        else:
-            self.next = self.construct_next_cursor(results[-1], self.ordering)
-            self.page = results[:-1]
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        self.page = results
+        self.next = self.previous = None
+        if results:
+            if has_more or reverse:
+                self.next = self.encode_cursor(self.NEXT, results[-1])
+            if (has_more and reverse) or (not reverse and kwargs and not custom):
+                self.previous = self.encode_cursor(self.PREVIOUS, results[0])
         return self.page
 
+    @staticmethod
+    def _reverse_ordering(ordering):
+        return tuple(item[1:] if item.startswith("-") else f"-{item}" for item in ordering)
+
+    @staticmethod
+    def _fields(ordering):
+        return [item[1:] if item.startswith("-") else item for item in ordering]
+
     def decode_cursor(self, request):
         """
-        Given a request with a cursor, return a `Cursor` instance.
+        :return: (方向, {字段: 值}), 没有游标时返回 None
         """
-        # Determine if we have a cursor, and if so then decode it.
         encoded = request.query_params.get(self.cursor_query_param)
         if encoded is None:
             return None
 
         try:
-            querystring = base64.b64decode(encoded.encode("ascii")).decode("ascii")
-            return dict(parse_qsl(querystring, keep_blank_values=True))
-        except (TypeError, ValueError):
-            return
+            direction, values = signing.loads(encoded, salt=self.cursor_salt)
+            fields = self._fields(self.ordering)
+            if direction not in (self.NEXT, self.PREVIOUS) or len(values) != len(fields):
+                raise ValueError
+            return direction, {field: _decode_value(value) for field, value in zip(fields, values)}
+        except (signing.BadSignature, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
 
-    @staticmethod
-    def construct_next_cursor(inst, ordering):
-        fields = []
-        for field in ordering:
-            if field.startswith("-"):
-                fields.append(field[1:])
-            else:
-                fields.append(field)
-        msg = urlencode({field: getattr(inst, field) for field in fields})
-        return base64.b64encode(msg.encode("ascii")).decode("ascii")
+    def encode_cursor(self, direction, inst):
+        values = [_encode_value(getattr(inst, field)) for field in self._fields(self.ordering)]
+        return signing.dumps([direction, values], salt=self.cursor_salt, compress=True)
 
-    def get_filtering(self, request, queryset, view, **kwargs):
+    def has_custom_filtering(self, view):
+        return getattr(view, "get_filtering", None) is not None or self.filtering is not None
+
+    def get_filtering(self, request, queryset, view, reverse=False, **kwargs):
         """
-        Return a tuple of strings, that may be used in an `order_by` method.
+        Return a `Q` object used to filter rows after the cursor.
         """
         filter_fn = getattr(view, "get_filtering", None)
 
-        filtering = None
-
         if filter_fn:
-            filtering = filter_fn(request, queryset, **kwargs)
+            return filter_fn(request, queryset, **kwargs)
         elif self.filtering is not None:
-            filtering = self.filtering
+            return self.filtering
         elif not kwargs:
             return
-        else:
-            for item in self.ordering:
-                if item.startswith("-"):
-                    key = item[1:]
-                    sort_key = "lt"
-                else:
-                    key = item
-                    sort_key = "gt"
-
-                if key not in kwargs:
-                    continue
-
-                filter_item = Q(**{f"{key}__{sort_key}": kwargs[key]})
-                if filtering is None:
-                    filtering = filter_item
-                else:
-                    filtering &= filter_item
-
-        return filtering
+
+        ordering = self._reverse_ordering(self.ordering) if reverse else self.ordering
+        filtering = None
+        equal = Q()
+        for item in ordering:
+            if item.startswith("-"):
+                key, lookup = item[1:], "lt"
+            else:
+                key, lookup = item, "gt"
+
+            filter_item = equal & Q(**{f"{key}__{lookup}": kwargs[key]})
+            filtering = filter_item if filtering is None else filtering | filter_item
+            equal &= Q(**{key: kwargs[key]})
+
+        # 首个排序字段的范围条件
+        key = self._fields(ordering[:1])[0]
+        lookup = "lte" if ordering[0].startswith("-") else "gte"
+        return Q(**{f"{key}__{lookup}": kwargs[key]}) & filtering
 
     def get_ordering(self, request, queryset, view):
         """
@@ -105,16 +174,161 @@ class CursorPagination(CursorPagination):
         """
         ordering = getattr(view, "ordering", None)
         if not ordering:
-            ordering = self.ordering
+            ordering = type(self).ordering
 
         if isinstance(ordering, str):
             ordering = (ordering,)
+        ordering = tuple("id" if item.lstrip("-") == "pk" else item for item in ordering)
+
+        # 主键兜底, 方向与最后一个排序字段一致
+        if "id" not in self._fields(ordering):
+            ordering += ("-id" if ordering[-1].startswith("-") else "id",)
         return ordering
 
     def get_paginated_response(self, data):
-        resp = dict({"items": data, "next": self.next})
+        resp = dict({"items": data, "next": self.next, "previous": self.previous})
         return Response(resp)
 
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "items": schema,
+                "next": {"type": "string", "nullable": True},
+                "previous": {"type": "string", "nullable": True},
+            },
+        }
+
+
+class ExactCount:
+    """
+    精确计数, COUNT(*)
+    """
+
+    def count(self, queryset):
+        """
+        :return: (数量, 是否精确)
+        """
+        return queryset.count(), True
+
+    def display(self, count, exact):
+        return count
+
+
+class CachedCount(ExactCount):
+    """
+    精确计数, 按 SQL 指纹缓存 timeout 秒
+    """
+
+    def __init__(self, timeout=60, prefix="pc"):
+        self.timeout = timeout
+        self.prefix = prefix
+
+    def count(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        key = ":".join([self.prefix, queryset.model._meta.db_table, md5(f"{queryset.db}:{sql}:{params!r}")])
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, self.timeout)
+        return count, True
+
+
+class EstimateCount(ExactCount):
+    """
+    MySQL 执行计划估算: 无过滤条件时取 information_schema.TABLES.TABLE_ROWS, 否则取 EXPLAIN 的 rows * filtered
+    估算值小于 exact_below 时改为精确计数; 非 MySQL 时为精确计数
+    """
+
+    def __init__(self, exact_below=1000):
+        self.exact_below = exact_below
+
+    def estimate(self, queryset):
+        connection = connections[queryset.db]
+        with connection.cursor() as cursor:
+            if not queryset.query.where:
+                cursor.execute(
+                    "SELECT TABLE_ROWS FROM information_schema.TABLES "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+                return int(row[0] or 0) if row else None
+
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(f"EXPLAIN {sql}", params)
+            rows = namedtuple_fetchall(cursor)
+            if not rows or rows[0].rows is None:
+                return None
+            return int(rows[0].rows * float(rows[0].filtered or 100) / 100)
+
+    def count(self, queryset):
+        if connections[queryset.db].vendor != "mysql":
+            return super().count(queryset)
+
+        try:
+            estimate = self.estimate(queryset)
+        except Exception:  # noqa
+            logger.warning("estimate count failed", exc_info=True)
+            estimate = None
+        if estimate is None or estimate < self.exact_below:
+            return super().count(queryset)
+        return estimate, False
+
+
+class CappedCount(ExactCount):
+    """
+    最多数到 cap 条, 超出时显示为 "10000+"
+    """
+
+    def __init__(self, cap=10000):
+        self.cap = cap
+
+    def count(self, queryset):
+        count = queryset[: self.cap + 1].count()
+        if count > self.cap:
+            return self.cap, False
+        return count, True
+
+    def display(self, count, exact):
+        return count if exact else f"{count}+"
+
+
+class Paginator(DjangoPaginator):
+    def __init__(self, *args, count_strategy=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_strategy = count_strategy or ExactCount()
+        self.count_exact = True
+
+    @cached_property
+    def count(self):
+        count, self.count_exact = self.count_strategy.count(self.object_list)
+        return count
+
+    def validate_number(self, number):
+        self.count  # noqa 计数后才知道是否精确
+        if self.count_exact:
+            return super().validate_number(number)
+
+        # 估算/截断的数量不可靠, 不校验页码上限, 超出实际数据时返回空页
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages["invalid_page"])
+        if number < 1:
+            raise EmptyPage(self.error_messages["min_page"])
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.count_exact:
+            return super().page(number)
+
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom : bottom + self.per_page], number, self)
+
 
 class Pagination(PageNumberPagination):
     page_size = 20  # 每页显示多少条
@@ -122,10 +336,31 @@ class Pagination(PageNumberPagination):
     page_size_query_param = "page_size"  # 每页显示多少条
     max_page_size = 100  # 最大页码数限制，请求参数中如果超过了这个配置，不会报错，会按照此配置工作
 
+    # 计数方式, 视图可通过 count_strategy 属性覆盖, 如 CappedCount(10000)
+    count_strategy = ExactCount()
+
+    # 延迟关联: 先在覆盖索引上分页取主键, 再按主键回表, 视图可通过 deferred_join 属性开启
+    deferred_join = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        strategy = getattr(view, "count_strategy", None) or self.count_strategy
+        self.django_paginator_class = partial(Paginator, count_strategy=strategy)
+        if not getattr(view, "deferred_join", self.deferred_join):
+            return super().paginate_queryset(queryset, request, view)
+
+        ids = super().paginate_queryset(queryset.values_list("pk", flat=True), request, view)
+        if not ids:
+            return ids
+
+        rows = queryset.order_by().filter(pk__in=ids).in_bulk()
+        self.page.object_list = [rows[pk] for pk in ids if pk in rows]
+        return self.page.object_list
+
     def get_paginated_response(self, data):
+        paginator = self.page.paginator
         return Response(
             {
-                "total": self.page.paginator.count,
+                "total": paginator.count_strategy.display(paginator.count, paginator.count_exact),
                 "page": self.page.number,
                 "page_size": self.page.paginator.per_page,
                 "items": data,
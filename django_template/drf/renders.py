@@ -1,28 +1,104 @@
 import logging
 
-from rest_framework.renderers import JSONRenderer as DRFJSONRenderer
+import cbor2
+import msgpack
+import orjson
+from django.utils import timezone
+from rest_framework.renderers import BaseRenderer, JSONRenderer as DRFJSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
 
-from django_template.drf import JSONResponse
+from django_template.drf import envelope
 
 logger = logging.getLogger("django")
 
+# 与 DRF 默认输出一致: 紧凑, 不转义中文, UTC 时间以 Z 结尾
+ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+# orjson 不支持的类型(Decimal, timedelta, QuerySet, 惰性字符串等)交给 DRF 的 encoder
+_encoder = JSONEncoder()
+
+
+def dumps(data):
+    ret = orjson.dumps(data, default=_encoder.default, option=ORJSON_OPTIONS)
+    # 同 DRF, 转义 U+2028/U+2029 以兼容 javascript
+    if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+        ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+    return ret
+
+
+def wrap(data, renderer_context=None):
+    """
+    包装为 {data, msg, code, ts}
+    """
+    if data is None:
+        data = envelope()
+    elif not ("code" in data and "msg" in data and "data" in data):
+        if isinstance(data, list):
+            data = envelope({"items": data})
+        elif isinstance(data, dict):
+            data = envelope(data)
+
+    if renderer_context:
+        code = data.get("code", 0)
+        status_code = renderer_context["response"].status_code
+        if (code == 0 and status_code != 200) or (code != 0 and status_code == 200):
+            logger.info(f"{renderer_context['request']} " f"{renderer_context['response'].data}")
+    return data
+
 
 class JSONRenderer(DRFJSONRenderer):
     def render(self, data, accepted_media_type=None, renderer_context=None):
-        if data is None:
-            resp = JSONResponse()
-            data = resp.data
-        elif not ("code" in data and "msg" in data and "data" in data):
-            if isinstance(data, list):
-                resp = JSONResponse({"items": data})
-                data = resp.data
-            elif isinstance(data, dict):
-                resp = JSONResponse(data)
-                data = resp.data
-        code = data.get("code", 0)
-        if (code == 0 and renderer_context["response"].status_code != 200) or (
-            code != 0 and renderer_context["response"].status_code == 200
+        renderer_context = renderer_context or {}
+        data = wrap(data, renderer_context)
+
+        # 缩进/转义等非默认输出交给 DRF
+        if (
+            self.get_indent(accepted_media_type, renderer_context)
+            or self.ensure_ascii
+            or not self.compact
+            or not self.strict
         ):
-            logger.info(f"{renderer_context['request']} " f"{renderer_context['response'].data}")
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            return dumps(data)
+        except (TypeError, orjson.JSONEncodeError):
+            # 超过 64 位的整数等
+            return super().render(data, accepted_media_type, renderer_context)
 
-        return super().render(data, accepted_media_type, renderer_context)
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack, 与 JSONRenderer 相同的 {data, msg, code, ts} 结构, 时间等类型的表示也相同
+
+    """
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        data = wrap(data, renderer_context)
+        return msgpack.packb(data, default=_encoder.default, use_bin_type=True)
+
+
+def _cbor_default(encoder, value):
+    encoder.encode(_encoder.default(value))
+
+
+class CBORRenderer(BaseRenderer):
+    """
+    CBOR, 与 JSONRenderer 相同的 {data, msg, code, ts} 结构; datetime/Decimal/UUID 使用 CBOR 原生标签
+
+    """
+
+    media_type = "application/cbor"
+    format = "cbor"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        data = wrap(data, renderer_context)
+        # naive datetime 按当前时区处理
+        return cbor2.dumps(data, default=_cbor_default, timezone=timezone.get_current_timezone())
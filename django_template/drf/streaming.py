@@ -0,0 +1,72 @@
+import logging
+import time
+
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+
+from django_template.drf.renders import dumps
+
+logger = logging.getLogger("django")
+
+
+def stream_items(items, serialize=None, code=0, msg="", buffer_size=65536):
+    """
+    逐条输出 {"data": {"items": [...]}, "msg": "", "code": 0, "ts": ...}, 与 JSONRenderer 的输出一致
+
+    :param items: 可迭代对象
+    :param serialize: 单条数据的序列化函数
+    :param buffer_size: 累计到该字节数后输出一次
+    """
+    ts = int(time.time() * 1000)
+    buf = bytearray(b'{"data":{"items":[')
+    first = True
+    try:
+        for item in items:
+            if serialize is not None:
+                item = serialize(item)
+            if not first:
+                buf += b","
+            buf += dumps(item)
+            first = False
+            if len(buf) >= buffer_size:
+                yield bytes(buf)
+                buf.clear()
+    except Exception:
+        # 响应头已发出, 只能中断输出
+        logger.error("stream items failed", exc_info=True)
+        raise
+
+    buf += b']},"msg":' + dumps(msg) + b',"code":' + dumps(code) + b',"ts":' + dumps(ts) + b"}"
+    yield bytes(buf)
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    """
+    大结果集流式返回, queryset 使用 .iterator(chunk_size) 分批读取
+
+    """
+
+    def __init__(self, items, serialize=None, chunk_size=2000, code=0, msg="", **kwargs):
+        if isinstance(items, QuerySet):
+            items = items.iterator(chunk_size=chunk_size)
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(stream_items(items, serialize, code, msg), **kwargs)
+
+
+class StreamingListMixin:
+    """
+    GenericAPIView 的流式 list
+
+    """
+
+    stream_chunk_size = 2000
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        # 复用同一个 serializer 实例, 避免逐条实例化
+        serializer = self.get_serializer()
+        return StreamingJSONResponse(
+            queryset,
+            serialize=serializer.to_representation,
+            chunk_size=self.stream_chunk_size,
+        )
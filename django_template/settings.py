@@ -52,6 +52,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "django_template.drf.models.LoggingRequestMiddleware",
+    "django_template.drf.models.CompressionMiddleware",
+    "django_template.drf.models.ReadYourWritesMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -90,7 +93,8 @@ DATABASES = {
         "NAME": BASE_DIR / "db.sqlite3",
     },
     "mysql": {
-        "ENGINE": "django.db.backends.mysql",
+        # 带连接池的 mysql backend, 见 db/backends/mysql/base.py
+        "ENGINE": "db.backends.mysql",
         "NAME": "django_template",
         "USER": "django_template",
         "PASSWORD": "",
@@ -100,6 +104,11 @@ DATABASES = {
             "charset": "utf8mb4",
             "POOL_SIZE": 50,
             "MAX_OVERFLOW": 50,
+            # 连接耗尽时等待秒数
+            "TIMEOUT": 30,
+            # 连接最长存活秒数, 需小于 MySQL wait_timeout
+            "RECYCLE": 3600,
+            "PRE_PING": True,
         },
         "OPTIONS": {
             "init_command": "SET foreign_key_checks = 0;",
@@ -120,11 +129,34 @@ DATABASES = {
 #                 "max_connections": 100,
 #                 "health_check_interval": 30,
 #             },
+#             # 配合 utils.redisx 熔断, 避免 redis 变慢时阻塞请求
+#             "SOCKET_CONNECT_TIMEOUT": 0.2,
+#             "SOCKET_TIMEOUT": 0.2,
 #         },
 #         "KEY_PREFIX": "{{ project_name }}",
 #     }
 # }
 
+# utils.redisx
+REDISX = {
+    # 熔断: 连续失败 5 次后熔断 5 秒
+    "CIRCUIT_BREAKER": {
+        "failure_threshold": 5,
+        "recovery_timeout": 5,
+        "slow_call_threshold": 0.2,
+    },
+    # 缓存不可用时 RateLimit 是否放行
+    "RATE_LIMIT_FAIL_OPEN": True,
+}
+
+# 响应压缩, zstd/br 需要安装 zstandard/brotli
+COMPRESSION = {
+    "ENCODINGS": ["zstd", "br", "gzip"],
+    "LEVEL": {"zstd": 3, "br": 4, "gzip": 6},
+    "MIN_SIZE": 512,
+    "EXCLUDE_PATHS": ["/docs", "/schema", "/redoc", "/static"],
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -176,8 +208,17 @@ REST_FRAMEWORK = {
     "EXCEPTION_HANDLER": "django_template.drf.exceptions.exception_handler",
     "DEFAULT_RENDERER_CLASSES": [
         "django_template.drf.renders.JSONRenderer",
+        "django_template.drf.renders.MessagePackRenderer",
+        "django_template.drf.renders.CBORRenderer",
         "rest_framework.renderers.BrowsableAPIRenderer",
     ],
+    "DEFAULT_PARSER_CLASSES": [
+        "django_template.drf.parsers.JSONParser",
+        "django_template.drf.parsers.MessagePackParser",
+        "django_template.drf.parsers.CBORParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
     # 分页
     # "DEFAULT_PAGINATION_CLASS": "utils.pagination.Pagination",
     # 查询
@@ -237,9 +278,26 @@ SPECTACULAR_SETTINGS = {
     # "SWAGGER_UI_FAVICON_HREF": "",
 }
 
+# 读写分离, 配合 db.router.ReplicaRouter
+READ_WRITE_SPLIT = {
+    "PRIMARY": "default",
+    # 从库别名, 需在 DATABASES 中配置; 为空时不分离
+    "REPLICAS": [],
+    # round_robin / least_connections
+    "STRATEGY": "round_robin",
+    # 复制延迟超过该秒数时摘除从库
+    "MAX_LAG": 5,
+    "LAG_CHECK_INTERVAL": 5,
+    # 写入后多少秒内读主库
+    "PIN_SECONDS": 3,
+    "PIN_COOKIE": "db_pin",
+}
+
 # 多数据库路由
 # DATABASE_ROUTERS = [
+#     "db.router.ShardRouter",
 #     "db.router.OtherRouter",
+#     "db.router.ReplicaRouter",
 # ]
 
 # Celery Configuration Options
@@ -4,10 +4,11 @@ import time
 from datetime import datetime, timedelta
 
 from django.conf import settings
+from django.utils import timezone
 
 from apps.account import consts
-from apps.account.models import VerifyCode
-from utils.redisx import RateLimit
+from apps.account.models import verify_codes
+from utils.redisx import MultiRateLimit, RateLimitRule
 
 logger = logging.getLogger("django")
 
@@ -15,16 +16,18 @@ logger = logging.getLogger("django")
 class SMSService:
     @staticmethod
     def gen_code(phone):
-        with (
-            RateLimit(
-                key=consts.RL_VERIFY_CODE_DAY % (time.strftime("%Y%m%d"), phone),
-                limit=10,
-                timeout=86400,
-            ),
-            RateLimit(key=consts.RL_VERIFY_CODE_HOUR % phone, limit=5, timeout=3600),
+        with MultiRateLimit(
+            [
+                RateLimitRule(
+                    key=consts.RL_VERIFY_CODE_DAY % (time.strftime("%Y%m%d"), phone),
+                    limit=10,
+                    timeout=86400,
+                ),
+                RateLimitRule(key=consts.RL_VERIFY_CODE_HOUR % phone, limit=5, timeout=3600),
+            ]
         ):
             code = random.randint(1000, 9999)
-            VerifyCode.objects.create(
+            verify_codes.ensure().objects.create(
                 phone=phone,
                 code=code,
                 expiration_time=datetime.now() + timedelta(seconds=300),
@@ -33,12 +36,17 @@ class SMSService:
 
     @staticmethod
     def verify_code(phone, code):
-        qs = VerifyCode.objects.filter(phone=phone, used=0).order_by("-id")[:1]
+        # 只查询最近一天内的分区
+        qs = verify_codes.read(
+            timezone.now() - timedelta(days=1),
+            lambda model: model.objects.filter(phone=phone, used=0).order_by("-id")[:1],
+            limit=1,
+        )
         if not qs:
             return False, "请先发送验证码"
 
-        id_ = qs[0].id
-        cnt = VerifyCode.objects.filter(id=id_, used=0, expiration_time__gte=datetime.now(), code=code).update(used=1)
+        model, id_ = type(qs[0]), qs[0].id
+        cnt = model.objects.filter(id=id_, used=0, expiration_time__gte=datetime.now(), code=code).update(used=1)
         if cnt == 0:
             return False, "短信验证码错误"
         return True, ""
@@ -81,7 +81,7 @@ class WeChatMP:
         return True, resp_json
 
     @staticmethod
-    @cache_fn(key=consts.CM_WECHAT_MP_ACCESS_TOKEN, timeout=7000)
+    @cache_fn(key=consts.CM_WECHAT_MP_ACCESS_TOKEN, timeout=7000, single_flight=True, stale_timeout=200, beta=1)
     def get_access_token():
         """
         获取接口调用凭证
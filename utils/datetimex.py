@@ -102,6 +102,14 @@ def move_day(date: datetime.datetime, day: int) -> datetime.datetime:
     return date + relativedelta(days=day)
 
 
+def move_month(date: datetime.datetime, month: int) -> datetime.datetime:
+    """
+    Before & After
+    month: 正数:以后;负数:以前, 月末日期自动截断, 如 3-31 前移一月为 2-28/29
+    """
+    return date + relativedelta(months=month)
+
+
 def seconds_remaining() -> int:
     """
     :return: 截止到当前当日剩余秒数
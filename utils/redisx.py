@@ -1,49 +1,684 @@
+import asyncio
 import inspect
+import logging
+import math
+import os
+import pickle
+import random
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict, namedtuple
 from functools import wraps
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.cache import cache
 
+logger = logging.getLogger("django")
 
-def cache_fn(key, timeout=5, condition=None, prefix="cf"):
+# 一级缓存失效通知
+L1_INVALIDATE_CHANNEL = "redisx:l1:invalidate"
+
+
+class CircuitOpenError(Exception):
+    """
+    熔断中, 不访问缓存后端
+
+    """
+
+
+def _backend_errors():
+    errors = [OSError, CircuitOpenError]
+    try:
+        from redis.exceptions import RedisError
+
+        errors.append(RedisError)
+    except ImportError:
+        pass
+    try:
+        from django_redis.exceptions import ConnectionInterrupted
+
+        errors.append(ConnectionInterrupted)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+# 缓存后端不可用时的异常, 包括熔断
+BACKEND_ERRORS = _backend_errors()
+
+
+class CircuitBreaker:
     """
+    缓存后端熔断器
+
+    连续失败(或慢调用) failure_threshold 次后熔断, 熔断期间直接抛出 CircuitOpenError;
+    recovery_timeout 秒后进入半开状态, 放行 half_open_calls 个探测请求, 成功则恢复
+
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, recovery_timeout=5, slow_call_threshold=None, half_open_calls=1):
+        """
+        :param failure_threshold: 连续失败次数
+        :param recovery_timeout: 熔断时长(秒)
+        :param slow_call_threshold: 超过该耗时(秒)的调用记为失败, None 不限制
+        :param half_open_calls: 半开状态下的探测请求数
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.slow_call_threshold = slow_call_threshold
+        self.half_open_calls = half_open_calls
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    raise CircuitOpenError
+                self.state = self.HALF_OPEN
+                self._probes = 0
+            if self.state == self.HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    raise CircuitOpenError
+                self._probes += 1
+
+    def on_success(self, elapsed):
+        if self.slow_call_threshold is not None and elapsed > self.slow_call_threshold:
+            self.on_failure()
+            return
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("redisx: circuit closed")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def on_ignored(self):
+        """
+        非后端异常(如反序列化失败)不计入成功/失败, 归还半开状态的探测名额
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def on_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"redisx: circuit open, failures={self.failures}")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def call(self, fn, *args, **kwargs):
+        self.before_call()
+        t0 = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except BACKEND_ERRORS:
+            self.on_failure()
+            raise
+        except BaseException:
+            self.on_ignored()
+            raise
+        self.on_success(time.monotonic() - t0)
+        return result
+
+    async def acall(self, fn, *args, **kwargs):
+        self.before_call()
+        t0 = time.monotonic()
+        try:
+            result = await fn(*args, **kwargs)
+        except BACKEND_ERRORS:
+            self.on_failure()
+            raise
+        except BaseException:
+            self.on_ignored()
+            raise
+        self.on_success(time.monotonic() - t0)
+        return result
+
+
+_breaker = None
+
+
+def get_breaker():
+    global _breaker
+
+    if _breaker is None:
+        conf = getattr(settings, "REDISX", {})
+        _breaker = CircuitBreaker(**conf.get("CIRCUIT_BREAKER", {}))
+    return _breaker
+
+
+def _safe(fn, *args, default=None, **kwargs):
+    """
+    失败放行: 缓存后端异常或熔断时返回 default
+    """
+    try:
+        return get_breaker().call(fn, *args, **kwargs)
+    except BACKEND_ERRORS:
+        return default
+
+
+async def _asafe(fn, *args, default=None, **kwargs):
+    try:
+        return await get_breaker().acall(fn, *args, **kwargs)
+    except BACKEND_ERRORS:
+        return default
+
+
+def _build_key(key, fn, args, kwargs):
+    if callable(key):
+        call_args = inspect.getcallargs(fn, *args, **kwargs)
+        return key(*call_args.values())
+    elif isinstance(key, str):
+        return key
+    raise RuntimeError("key is not a string or callable object")
+
+
+def _need_cache(value, condition):
+    if condition is None:
+        return True if value else False
+    elif callable(condition):
+        return bool(condition(value))
+    elif isinstance(condition, bool):
+        return condition
+    raise RuntimeError("Not support")
+
+
+def _need_refresh(entry, beta):
+    """
+    XFetch: 临近过期时按概率提前重算, 重算耗时越长越早
+
+    entry: (value, delta, expire_at)
+    """
+    _, delta, expire_at = entry
+    now = time.time()
+    if beta <= 0:
+        return now >= expire_at
+    return now - delta * beta * math.log(1 - random.random()) >= expire_at
+
+
+class LRUCache:
+    """
+    进程内 LRU 缓存(一级缓存)
+
+    与 redis 一致按 pickle 存储, 每次 get 返回新的副本, 调用方原地修改结果不会影响其他线程
+    """
+
+    def __init__(self, maxsize=1024, timeout=1):
+        """
+        :param maxsize: 最大条目数, 超出后淘汰最久未使用的
+        :param timeout: 超时时间(秒)
+        """
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expire_at = item
+                if expire_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return pickle.loads(value)
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def _get_redis():
+    """
+    django_redis 原生客户端, 非 redis 缓存后端返回 None
+    """
+    try:
+        from django_redis import get_redis_connection
+
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        return None
+
+
+_scripts = {}
+
+
+def eval_script(lua, keys, args):
+    """
+    执行 lua 脚本, keys 经 cache.make_key 处理, 与 cache.get/set 的 key 一致
+
+    """
+    client = _get_redis()
+    if client is None:
+        raise RuntimeError("redis cache backend is required")
+    script = _scripts.get(lua)
+    if script is None:
+        script = _scripts[lua] = client.register_script(lua)
+    return script(keys=[cache.make_key(k) for k in keys], args=args, client=client)
+
+
+_LUA_NOW = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+"""
+
+_l1_caches = weakref.WeakSet()
+_l1_listener = None  # (pid, thread)
+_l1_listener_lock = threading.Lock()
+
+
+def _evict_l1(key):
+    for lru in list(_l1_caches):
+        if key == "*":
+            lru.clear()
+        else:
+            lru.delete(key)
+
+
+def _listen_l1_invalidate(client):
+    while True:
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(L1_INVALIDATE_CHANNEL)
+            # 重新订阅期间可能漏掉通知
+            _evict_l1("*")
+            while True:
+                # 轮询而不是 listen(): 连接池配置了 SOCKET_TIMEOUT 时, 频道空闲不会被当作连接失败
+                message = pubsub.get_message(timeout=1)
+                if message is None:
+                    continue
+                data = message["data"]
+                _evict_l1(data.decode() if isinstance(data, bytes) else data)
+        except Exception:  # noqa
+            logger.warning("redisx: l1 invalidate listener failed", exc_info=True)
+            time.sleep(1)
+
+
+def _ensure_l1_listener():
+    """
+    懒启动订阅线程; fork 后的子进程需要重新启动
+    """
+    global _l1_listener
+
+    pid = os.getpid()
+    if _l1_listener is not None and _l1_listener[0] == pid:
+        return
+    with _l1_listener_lock:
+        if _l1_listener is not None and _l1_listener[0] == pid:
+            return
+        client = _get_redis()
+        if client is None:
+            logger.warning("redisx: cache backend is not redis, l1 relies on timeout only")
+            _l1_listener = (pid, None)
+            return
+        thread = threading.Thread(target=_listen_l1_invalidate, args=(client,), name="redisx-l1", daemon=True)
+        thread.start()
+        _l1_listener = (pid, thread)
+
+
+def _envelope_key(ck):
+    """
+    single_flight/beta 模式的缓存 key
+    """
+    return ":".join([ck, "sf"])
+
+
+def invalidate(key):
+    """
+    删除缓存, 并通知所有节点清除一级缓存
+
+    :param key: 完整的缓存 key(含前缀), "*" 清除全部一级缓存
+    """
+    if key != "*":
+        cache.delete_many([key, _envelope_key(key)])
+    _evict_l1(key)
+    client = _get_redis()
+    if client is not None:
+        client.publish(L1_INVALIDATE_CHANNEL, key)
+
+
+class _FnCache:
+    """
+    cache_fn 的缓存 key、缓存格式、统计及一级缓存, 同步/异步版本共用
+    """
+
+    def __init__(
+        self,
+        fn,
+        key,
+        timeout,
+        condition,
+        prefix,
+        single_flight,
+        lease_timeout,
+        wait_timeout,
+        stale_timeout,
+        beta,
+        local_timeout,
+        local_maxsize,
+    ):
+        self.fn = fn
+        self.key = key
+        self.timeout = timeout
+        self.condition = condition
+        self.prefix = prefix
+        self.single_flight = single_flight
+        self.lease_timeout = lease_timeout
+        self.wait_timeout = wait_timeout
+        self.stale_timeout = stale_timeout
+        self.beta = beta
+        # 开启 single_flight/beta 时在 <key>:sf 缓存 (value, delta, expire_at),
+        # 与普通模式分开存储, 未开启的旧版本进程不会把它当作缓存值返回
+        self.envelope = single_flight or beta > 0
+        self.stats = {"l2_hit": 0, "l2_miss": 0}
+        self.lru = None
+        if local_timeout > 0:
+            self.lru = LRUCache(maxsize=local_maxsize, timeout=local_timeout)
+            _l1_caches.add(self.lru)
+
+    def make_key(self, args, kwargs):
+        return ":".join([self.prefix, _build_key(self.key, self.fn, args, kwargs)])
+
+    def storage_key(self, ck):
+        return _envelope_key(ck) if self.envelope else ck
+
+    def lease_key(self, ck):
+        return ":".join([ck, "lease"])
+
+    def to_cache(self, value, t0):
+        """
+        :return: (缓存值, 超时时间), 不需要缓存时返回 None
+        """
+        if not _need_cache(value, self.condition):
+            return None
+        if not self.envelope:
+            return value, self.timeout
+        t1 = time.time()
+        return (value, t1 - t0, t1 + self.timeout), self.timeout + self.stale_timeout
+
+    def is_fresh(self, entry):
+        """
+        命中且不需要(提前)重算, 同时记录命中/未命中次数
+        """
+        fresh = entry is not None and not (self.envelope and _need_refresh(entry, self.beta))
+        self.stats["l2_hit" if fresh else "l2_miss"] += 1
+        return fresh
+
+    def unwrap(self, entry):
+        return entry[0] if self.envelope else entry
+
+    def get_local(self, ck):
+        if self.lru is None:
+            return None
+        _ensure_l1_listener()
+        return self.lru.get(ck)
+
+    def set_local(self, ck, value):
+        if self.lru is not None and value is not None and _need_cache(value, self.condition):
+            self.lru.set(ck, value)
+
+    def bind(self, wrapper, invalidate_):
+        def stats_():
+            result = dict(self.stats)
+            if self.lru is not None:
+                result.update({"l1_hit": self.lru.hits, "l1_miss": self.lru.misses, "l1_size": len(self.lru)})
+            return result
+
+        wrapper.invalidate = invalidate_
+        wrapper.stats = stats_
+        wrapper.local_cache = self.lru
+        return wrapper
+
+
+def _cached(fc):
+    fn = fc.fn
+
+    def compute(ck, args, kwargs):
+        t0 = time.time()
+        value = fn(*args, **kwargs)
+        item = fc.to_cache(value, t0)
+        if item is not None:
+            _safe(cache.set, fc.storage_key(ck), *item)
+        return value
+
+    def wait(ck, args, kwargs):
+        deadline = time.monotonic() + fc.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(random.uniform(0.02, 0.1))
+            entry = _safe(cache.get, fc.storage_key(ck))
+            if entry is not None:
+                return fc.unwrap(entry)
+        return compute(ck, args, kwargs)
+
+    def load(ck, args, kwargs):
+        entry = _safe(cache.get, fc.storage_key(ck))
+        if fc.is_fresh(entry):
+            return fc.unwrap(entry)
+        if not fc.single_flight:
+            return compute(ck, args, kwargs)
+
+        lease = fc.lease_key(ck)
+        # 缓存不可用时直接计算
+        if _safe(cache.add, lease, 1, fc.lease_timeout, default=True):
+            try:
+                return compute(ck, args, kwargs)
+            finally:
+                _safe(cache.delete, lease)
+
+        # 其他调用方正在重算
+        if entry is not None:
+            return fc.unwrap(entry)
+        return wait(ck, args, kwargs)
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        ck = fc.make_key(args, kwargs)
+        value = fc.get_local(ck)
+        if value is not None:
+            return value
+        value = load(ck, args, kwargs)
+        fc.set_local(ck, value)
+        return value
+
+    def invalidate_(*args, **kwargs):
+        invalidate(fc.make_key(args, kwargs))
+
+    return fc.bind(wrapper, invalidate_)
+
+
+def _acached(fc):
+    fn = fc.fn
+
+    async def compute(ck, args, kwargs):
+        t0 = time.time()
+        value = await fn(*args, **kwargs)
+        item = fc.to_cache(value, t0)
+        if item is not None:
+            await _asafe(cache.aset, fc.storage_key(ck), *item)
+        return value
+
+    async def wait(ck, args, kwargs):
+        deadline = time.monotonic() + fc.wait_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(random.uniform(0.02, 0.1))
+            entry = await _asafe(cache.aget, fc.storage_key(ck))
+            if entry is not None:
+                return fc.unwrap(entry)
+        return await compute(ck, args, kwargs)
+
+    async def load(ck, args, kwargs):
+        entry = await _asafe(cache.aget, fc.storage_key(ck))
+        if fc.is_fresh(entry):
+            return fc.unwrap(entry)
+        if not fc.single_flight:
+            return await compute(ck, args, kwargs)
+
+        lease = fc.lease_key(ck)
+        if await _asafe(cache.aadd, lease, 1, fc.lease_timeout, default=True):
+            try:
+                return await compute(ck, args, kwargs)
+            finally:
+                await _asafe(cache.adelete, lease)
+
+        if entry is not None:
+            return fc.unwrap(entry)
+        return await wait(ck, args, kwargs)
+
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        ck = fc.make_key(args, kwargs)
+        value = fc.get_local(ck)
+        if value is not None:
+            return value
+        value = await load(ck, args, kwargs)
+        fc.set_local(ck, value)
+        return value
+
+    async def invalidate_(*args, **kwargs):
+        await sync_to_async(invalidate, thread_sensitive=False)(fc.make_key(args, kwargs))
+
+    return fc.bind(wrapper, invalidate_)
+
+
+def cache_fn(
+    key,
+    timeout=5,
+    condition=None,
+    prefix="cf",
+    single_flight=False,
+    lease_timeout=10,
+    wait_timeout=3,
+    stale_timeout=0,
+    beta=0,
+    local_timeout=0,
+    local_maxsize=1024,
+):
+    """
+    支持 async def, 使用 Django 的异步缓存接口
 
     :param key: 缓存 key
     :param timeout: 超时时间
     :param condition: 是否需要缓存
     :param prefix: 缓存前缀
+    :param single_flight: 过期后只允许一个调用方重算(持有租约), 其他调用方返回旧值或短暂等待
+    :param lease_timeout: 重算租约的超时时间
+    :param wait_timeout: 没有旧值时等待重算结果的最长时间, 超时后自行计算
+    :param stale_timeout: 逻辑过期后旧值继续保留的时间
+    :param beta: 提前重算系数, 0 不提前; 1 为推荐值, 越大越早
+    :param local_timeout: 一级(进程内)缓存超时时间, 0 不启用
+    :param local_maxsize: 一级缓存最大条目数
+
+    开启一级缓存后请使用 `invalidate` 或 `fn.invalidate` 删除缓存, 以便通知其他节点
+    """
+
+    def decorate(fn):
+        fc = _FnCache(
+            fn,
+            key,
+            timeout,
+            condition,
+            prefix,
+            single_flight,
+            lease_timeout,
+            wait_timeout,
+            stale_timeout,
+            beta,
+            local_timeout,
+            local_maxsize,
+        )
+        if inspect.iscoroutinefunction(fn):
+            return _acached(fc)
+        return _cached(fc)
+
+    return decorate
+
+
+# cache_fn 已支持 async def, 保留别名
+acache_fn = cache_fn
+
+
+def cache_many_fn(key, timeout=5, condition=None, prefix="cf"):
+    """
+    批量缓存, 被装饰函数的第一个参数为 id 列表, 返回 {id: value}
+
+    一次 get_many 读取, 只用未命中的 id 调用函数, 再一次 set_many 写回
+
+    :param key: 字符串(如 "account:%s")或可调用对象, 参数为单个 id
+    :param timeout: 超时时间
+    :param condition: 是否需要缓存, 对每个 value 单独判断
+    :param prefix: 缓存前缀
     """
 
+    def make_key(id_):
+        if callable(key):
+            _key = key(id_)
+        elif isinstance(key, str):
+            _key = key % id_
+        else:
+            raise RuntimeError("key is not a string or callable object")
+        return ":".join([prefix, _key])
+
     def decorate(fn):
         @wraps(fn)
-        def wrapper(*args, **kwargs):
-            if callable(key):
-                call_args = inspect.getcallargs(fn, *args, **kwargs)
-                _key = key(*call_args.values())
-            elif isinstance(key, str):
-                _key = key
-            else:
-                raise RuntimeError("key is not a string or callable object")
-
-            ck = ":".join([prefix, _key])
-
-            value = cache.get(ck)
-            if value is not None:
-                return value
-
-            value = fn(*args, **kwargs)
-
-            if condition is None:
-                _condition = True if value else False
-            elif callable(condition):
-                _condition = bool(condition(value))
-            elif isinstance(condition, bool):
-                _condition = condition
-            else:
-                raise RuntimeError("Not support")
-
-            if _condition:
-                cache.set(ck, value, timeout=timeout)
-            return value
+        def wrapper(ids, *args, **kwargs):
+            ids = list(dict.fromkeys(ids))
+            if not ids:
+                return {}
+
+            keys = {id_: make_key(id_) for id_ in ids}
+            cached = _safe(cache.get_many, keys.values(), default={})
+
+            result = {}
+            missing = []
+            for id_, ck in keys.items():
+                if ck in cached:
+                    result[id_] = cached[ck]
+                else:
+                    missing.append(id_)
+
+            if not missing:
+                return result
+
+            values = fn(missing, *args, **kwargs) or {}
+            to_cache = {keys[id_]: value for id_, value in values.items() if _need_cache(value, condition)}
+            if to_cache:
+                _safe(cache.set_many, to_cache, timeout=timeout)
+
+            result.update(values)
+            return result
 
         return wrapper
 
@@ -57,29 +692,136 @@ class AcquireLockError(Exception):
     """
 
 
+# 持有者校验后删除/续期, 锁的值为整数 token(django_redis 不序列化整数)
+_LUA_COMPARE_DELETE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_LUA_COMPARE_EXPIRE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def _backoff(attempt, base=0.05, cap=1.0):
+    """
+    指数退避 + full jitter
+    """
+    # 限制指数, 无限等待时 2**attempt 过大会溢出 float
+    return random.uniform(0, min(cap, base * 2 ** min(attempt, 16)))
+
+
 class CurrencyLock:
-    def __init__(self, key, timeout=3600, fixed=False):
+    def __init__(self, key, timeout=3600, fixed=False, blocking=False, blocking_timeout=None, renew=False):
         """
         :param key:
-        :param timeout:
+        :param timeout: 锁的租期
+        :param fixed: 结束后是否保留锁
+        :param blocking: 获取失败时是否等待(指数退避)
+        :param blocking_timeout: 最长等待时间, None 一直等待
+        :param renew: 持有期间后台每 timeout/3 续期一次, 可配合较短的 timeout 使用
 
         """
         self.locked = False
         self.timeout = timeout
         self.key = key
         self.fixed = fixed
+        self.blocking = blocking
+        self.blocking_timeout = blocking_timeout
+        self.renew = renew
+        self.token = None
+        self.lost = False  # 续期时发现锁已不属于自己
+        self._watchdog = None
+        self._stop = None
+
+    def _try_acquire(self):
+        return cache.add(self.key, self.token, self.timeout)
+
+    async def _atry_acquire(self):
+        return await cache.aadd(self.key, self.token, self.timeout)
 
     def _acquire_lock(self):
-        return cache.add(self.key, 1, self.timeout)
+        self.token = random.getrandbits(62)
+        deadline = None if self.blocking_timeout is None else time.monotonic() + self.blocking_timeout
+        attempt = 0
+        while True:
+            try:
+                if get_breaker().call(self._try_acquire):
+                    return True
+            except BACKEND_ERRORS:
+                # 失败拒绝
+                logger.warning(f"redisx: acquire lock {self.key} failed", exc_info=True)
+                return False
+            if not self.blocking or (deadline is not None and time.monotonic() >= deadline):
+                return False
+            delay = _backoff(attempt)
+            if deadline is not None:
+                delay = min(delay, max(deadline - time.monotonic(), 0))
+            time.sleep(delay)
+            attempt += 1
+
+    def _compare_delete(self):
+        if _get_redis() is not None:
+            return bool(eval_script(_LUA_COMPARE_DELETE, keys=[self.key], args=[self.token]))
+        # 非 redis 后端, 尽力而为
+        if cache.get(self.key) == self.token:
+            return cache.delete(self.key)
+        return False
+
+    def extend(self, timeout=None):
+        """
+        续期, 锁已不属于自己时返回 False
+        """
+        timeout = timeout or self.timeout
+        if _get_redis() is not None:
+            return bool(eval_script(_LUA_COMPARE_EXPIRE, keys=[self.key], args=[self.token, int(timeout * 1000)]))
+        if cache.get(self.key) == self.token:
+            return cache.touch(self.key, timeout)
+        return False
+
+    def _keep_alive(self):
+        interval = max(self.timeout / 3, 0.1)
+        while not self._stop.wait(interval):
+            try:
+                if not self.extend():
+                    self.lost = True
+                    logger.warning(f"redisx: lock {self.key} lost before release")
+                    return
+            except Exception:  # noqa
+                logger.warning(f"redisx: lock {self.key} renew failed", exc_info=True)
+
+    def _start_watchdog(self):
+        if not self.renew:
+            return
+        self._stop = threading.Event()
+        self._watchdog = threading.Thread(target=self._keep_alive, name=f"redisx-lock:{self.key}", daemon=True)
+        self._watchdog.start()
+
+    def _stop_watchdog(self):
+        if self._watchdog is not None:
+            self._stop.set()
+            self._watchdog.join()
+            self._watchdog = None
 
     def _release_lock(self):
+        self._stop_watchdog()
         if not self.fixed:
-            cache.delete(self.key)
+            try:
+                get_breaker().call(self._compare_delete)
+            except BACKEND_ERRORS:
+                # 等待租期到期
+                logger.warning(f"redisx: release lock {self.key} failed", exc_info=True)
 
     def __enter__(self):
         self.locked = self._acquire_lock()
         if self.locked:
             # 获取锁成功
+            self._start_watchdog()
             return
 
         raise AcquireLockError
@@ -87,6 +829,69 @@ class CurrencyLock:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._release_lock()
 
+    async def _aacquire_lock(self):
+        self.token = random.getrandbits(62)
+        deadline = None if self.blocking_timeout is None else time.monotonic() + self.blocking_timeout
+        attempt = 0
+        while True:
+            try:
+                if await get_breaker().acall(self._atry_acquire):
+                    return True
+            except BACKEND_ERRORS:
+                logger.warning(f"redisx: acquire lock {self.key} failed", exc_info=True)
+                return False
+            if not self.blocking or (deadline is not None and time.monotonic() >= deadline):
+                return False
+            delay = _backoff(attempt)
+            if deadline is not None:
+                delay = min(delay, max(deadline - time.monotonic(), 0))
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def __aenter__(self):
+        self.locked = await self._aacquire_lock()
+        if self.locked:
+            self._start_watchdog()
+            return
+
+        raise AcquireLockError
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await sync_to_async(self._release_lock, thread_sensitive=False)()
+
+
+def _lock_decorator(make_lock, key, prefix, raise_exception, default_return):
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                ck = ":".join([prefix, _build_key(key, fn, args, kwargs)])
+                try:
+                    async with make_lock(ck):
+                        return await fn(*args, **kwargs)
+                except AcquireLockError:
+                    if raise_exception:
+                        raise
+                    return default_return
+
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            ck = ":".join([prefix, _build_key(key, fn, args, kwargs)])
+            try:
+                with make_lock(ck):
+                    return fn(*args, **kwargs)
+            except AcquireLockError:
+                if raise_exception:
+                    raise
+                return default_return
+
+        return wrapper
+
+    return decorate
+
 
 def currency_lock(
     key,
@@ -95,41 +900,270 @@ def currency_lock(
     fixed=False,
     default_return=None,
     prefix="cl",
+    blocking=False,
+    blocking_timeout=None,
+    renew=False,
 ):
     """
+    支持 async def
+
     :param key: 字符串或者可调用的函数
     :param timeout:
     :param raise_exception: 是否直接报错
     :param default_return: 获取锁失败时返回
     :param fixed: 结束后是否保留锁
     :param prefix: 获取锁失败时返回
+    :param blocking: 获取失败时是否等待
+    :param blocking_timeout: 最长等待时间
+    :param renew: 执行期间自动续期
 
     """
+    return _lock_decorator(
+        lambda ck: CurrencyLock(
+            ck,
+            timeout=timeout,
+            fixed=fixed,
+            blocking=blocking,
+            blocking_timeout=blocking_timeout,
+            renew=renew,
+        ),
+        key,
+        prefix,
+        raise_exception,
+        default_return,
+    )
 
-    def decorate(fn):
-        @wraps(fn)
-        def wrapper(*args, **kwargs):
-            if callable(key):
-                call_args = inspect.getcallargs(fn, *args, **kwargs)
-                _key = key(*call_args.values())
-            elif isinstance(key, str):
-                _key = key
-            else:
-                raise RuntimeError("Not support")
-
-            ck = ":".join([prefix, _key])
-            try:
-                with CurrencyLock(key=ck, timeout=timeout, fixed=fixed):
-                    return fn(*args, **kwargs)
-            except AcquireLockError:
-                if raise_exception:
-                    raise
 
-                return default_return
+# currency_lock 已支持 async def, 保留别名
+acurrency_lock = currency_lock
 
-        return wrapper
 
-    return decorate
+# 信号量: 有序集合, member 为 token, score 为过期时间, 崩溃的持有者到期自动释放
+_LUA_SEMAPHORE_ACQUIRE = (
+    _LUA_NOW
+    + """
+local ttl = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + ttl, ARGV[3])
+if redis.call('PTTL', KEYS[1]) < ttl then
+    redis.call('PEXPIRE', KEYS[1], ttl)
+end
+return 1
+"""
+)
+
+_LUA_SEMAPHORE_EXTEND = (
+    _LUA_NOW
+    + """
+local ttl = tonumber(ARGV[2])
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not score or tonumber(score) < now then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + ttl, ARGV[1])
+if redis.call('PTTL', KEYS[1]) < ttl then
+    redis.call('PEXPIRE', KEYS[1], ttl)
+end
+return 1
+"""
+)
+
+
+class Semaphore(CurrencyLock):
+    """
+    分布式计数信号量, 最多 limit 个持有者, 用法与 CurrencyLock 一致
+
+        with Semaphore("cs:wechat:subscribe", limit=10, timeout=30, blocking=True, blocking_timeout=5):
+            ...
+    """
+
+    def __init__(self, key, limit=1, timeout=60, **kwargs):
+        """
+        :param limit: 最大并发数
+        :param timeout: 单个持有者的租期, 到期未续期视为已释放
+        """
+        super().__init__(key, timeout=timeout, **kwargs)
+        self.limit = limit
+
+    def _try_acquire(self):
+        return bool(
+            eval_script(
+                _LUA_SEMAPHORE_ACQUIRE,
+                keys=[self.key],
+                args=[self.limit, int(self.timeout * 1000), self.token],
+            )
+        )
+
+    async def _atry_acquire(self):
+        return await sync_to_async(self._try_acquire, thread_sensitive=False)()
+
+    def _compare_delete(self):
+        return bool(eval_script("return redis.call('ZREM', KEYS[1], ARGV[1])", keys=[self.key], args=[self.token]))
+
+    def extend(self, timeout=None):
+        timeout = timeout or self.timeout
+        return bool(eval_script(_LUA_SEMAPHORE_EXTEND, keys=[self.key], args=[self.token, int(timeout * 1000)]))
+
+
+# 读写锁
+# KEYS: 读者有序集合, 写锁, 写者等待标记
+_LUA_RW_READ_ACQUIRE = (
+    _LUA_NOW
+    + """
+local ttl = tonumber(ARGV[1])
+if redis.call('EXISTS', KEYS[2]) == 1 or redis.call('EXISTS', KEYS[3]) == 1 then
+    return 0
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+redis.call('ZADD', KEYS[1], now + ttl, ARGV[2])
+if redis.call('PTTL', KEYS[1]) < ttl then
+    redis.call('PEXPIRE', KEYS[1], ttl)
+end
+return 1
+"""
+)
+
+_LUA_RW_WRITE_ACQUIRE = (
+    _LUA_NOW
+    + """
+local ttl = tonumber(ARGV[1])
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) > 0 then
+    if ARGV[3] == '1' then
+        -- 阻塞等待的写者阻止新读者进入, 避免写者饥饿
+        redis.call('SET', KEYS[3], ARGV[2], 'PX', 1000)
+    end
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[2], 'PX', ttl)
+local waiting = redis.call('GET', KEYS[3])
+if waiting == ARGV[2] then
+    redis.call('DEL', KEYS[3])
+end
+return 1
+"""
+)
+
+
+class RWLock(CurrencyLock):
+    """
+    分布式读写锁, 读锁可共享, 写锁独占
+
+        with RWLock("crw:config", mode=RWLock.READ):
+            ...
+    """
+
+    READ = "read"
+    WRITE = "write"
+
+    def __init__(self, key, mode=READ, timeout=60, **kwargs):
+        super().__init__(key, timeout=timeout, **kwargs)
+        self.mode = mode
+        self.keys = [":".join([key, "r"]), ":".join([key, "w"]), ":".join([key, "wait"])]
+
+    def _try_acquire(self):
+        ttl = int(self.timeout * 1000)
+        if self.mode == self.READ:
+            return bool(eval_script(_LUA_RW_READ_ACQUIRE, keys=self.keys, args=[ttl, self.token]))
+        blocking = "1" if self.blocking else "0"
+        return bool(eval_script(_LUA_RW_WRITE_ACQUIRE, keys=self.keys, args=[ttl, self.token, blocking]))
+
+    async def _atry_acquire(self):
+        return await sync_to_async(self._try_acquire, thread_sensitive=False)()
+
+    def _compare_delete(self):
+        if self.mode == self.READ:
+            return bool(
+                eval_script("return redis.call('ZREM', KEYS[1], ARGV[1])", keys=self.keys[:1], args=[self.token])
+            )
+        return bool(eval_script(_LUA_COMPARE_DELETE, keys=self.keys[1:2], args=[self.token]))
+
+    def extend(self, timeout=None):
+        timeout = timeout or self.timeout
+        if self.mode == self.READ:
+            return bool(eval_script(_LUA_SEMAPHORE_EXTEND, keys=self.keys[:1], args=[self.token, int(timeout * 1000)]))
+        return bool(eval_script(_LUA_COMPARE_EXPIRE, keys=self.keys[1:2], args=[self.token, int(timeout * 1000)]))
+
+
+def semaphore(
+    key,
+    limit=1,
+    timeout=60,
+    raise_exception=False,
+    default_return=None,
+    prefix="cs",
+    blocking=False,
+    blocking_timeout=None,
+    renew=False,
+):
+    """
+    限制被装饰函数在所有节点上的并发数, 支持 async def
+
+    :param key: 字符串或者可调用的函数
+    :param limit: 最大并发数
+    :param timeout: 单个持有者的租期
+    :param raise_exception: 是否直接报错
+    :param default_return: 获取失败时返回
+    :param prefix: 缓存前缀
+    :param blocking: 获取失败时是否等待
+    :param blocking_timeout: 最长等待时间
+    :param renew: 执行期间自动续期
+
+    """
+    return _lock_decorator(
+        lambda ck: Semaphore(
+            ck,
+            limit=limit,
+            timeout=timeout,
+            blocking=blocking,
+            blocking_timeout=blocking_timeout,
+            renew=renew,
+        ),
+        key,
+        prefix,
+        raise_exception,
+        default_return,
+    )
+
+
+def rw_lock(
+    key,
+    mode=RWLock.READ,
+    timeout=60,
+    raise_exception=False,
+    default_return=None,
+    prefix="crw",
+    blocking=False,
+    blocking_timeout=None,
+    renew=False,
+):
+    """
+    读写锁装饰器, 支持 async def
+
+    :param mode: RWLock.READ / RWLock.WRITE
+    其他参数同 semaphore
+
+    """
+    return _lock_decorator(
+        lambda ck: RWLock(
+            ck,
+            mode=mode,
+            timeout=timeout,
+            blocking=blocking,
+            blocking_timeout=blocking_timeout,
+            renew=renew,
+        ),
+        key,
+        prefix,
+        raise_exception,
+        default_return,
+    )
 
 
 def incr(key, delta, timeout):
@@ -139,6 +1173,11 @@ def incr(key, delta, timeout):
     return cnt
 
 
+async def aincr(key, delta, timeout):
+    # BaseCache.aincr 是非原子的 get + set, 且会重置过期时间
+    return await sync_to_async(incr, thread_sensitive=False)(key, delta, timeout)
+
+
 def decr(key, delta):
     try:
         return cache.decr(key, delta)
@@ -146,18 +1185,143 @@ def decr(key, delta):
         return
 
 
+# 滑动窗口日志: 有序集合记录每次请求的时间
+# return {allowed, remaining, retry_after(ms)}
+_LUA_SLIDING_LOG = (
+    _LUA_NOW
+    + """
+local key = KEYS[1]
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local delta = tonumber(ARGV[3])
+
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+local cnt = redis.call('ZCARD', key)
+if cnt + delta > limit then
+    local retry = window
+    local idx = cnt + delta - limit - 1
+    if idx < cnt then
+        local item = redis.call('ZRANGE', key, idx, idx, 'WITHSCORES')
+        retry = tonumber(item[2]) + window - now
+    end
+    return {0, math.max(limit - cnt, 0), retry}
+end
+for i = 1, delta do
+    redis.call('ZADD', key, now, ARGV[4] .. ':' .. i)
+end
+redis.call('PEXPIRE', key, window)
+return {1, limit - cnt - delta, 0}
+"""
+)
+
+# 滑动窗口计数: 上一窗口计数按剩余比例加权 + 当前窗口计数
+_LUA_SLIDING_WINDOW = (
+    _LUA_NOW
+    + """
+local key = KEYS[1]
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local delta = tonumber(ARGV[3])
+
+local cur = math.floor(now / window)
+local h = redis.call('HMGET', key, 'w', 'c', 'p')
+local w = tonumber(h[1]) or cur
+local c = tonumber(h[2]) or 0
+local p = tonumber(h[3]) or 0
+if w == cur - 1 then
+    p = c
+    c = 0
+elseif w ~= cur then
+    p = 0
+    c = 0
+end
+
+local elapsed = now - cur * window
+local est = p * (window - elapsed) / window + c
+if est + delta > limit then
+    local retry = window - elapsed
+    if c + delta <= limit and p > 0 then
+        retry = math.ceil(window * (1 - (limit - c - delta) / p)) - elapsed
+    end
+    return {0, math.max(math.floor(limit - est), 0), retry}
+end
+redis.call('HSET', key, 'w', cur, 'c', c + delta, 'p', p)
+redis.call('PEXPIRE', key, window * 2)
+return {1, math.floor(limit - est - delta), 0}
+"""
+)
+
+# 令牌桶: 容量 limit, 每 window 毫秒补满
+_LUA_TOKEN_BUCKET = (
+    _LUA_NOW
+    + """
+local key = KEYS[1]
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local delta = tonumber(ARGV[3])
+
+local h = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(h[1]) or limit
+local ts = tonumber(h[2]) or now
+tokens = math.min(limit, tokens + math.max(now - ts, 0) * limit / window)
+if tokens < delta then
+    return {0, math.floor(tokens), math.ceil((delta - tokens) * window / limit)}
+end
+tokens = tokens - delta
+redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', key, math.max(math.ceil((limit - tokens) * window / limit), 1))
+return {1, math.floor(tokens), 0}
+"""
+)
+
+
+def _check_rate_limit(limiter):
+    try:
+        return get_breaker().call(limiter._check)
+    except BACKEND_ERRORS:
+        fail_open = limiter.fail_open
+        if fail_open is None:
+            fail_open = getattr(settings, "REDISX", {}).get("RATE_LIMIT_FAIL_OPEN", True)
+        logger.warning(f"redisx: rate limit unavailable, fail_open={fail_open}", exc_info=True)
+        limiter.remaining = None
+        limiter.retry_after = None
+        return fail_open
+
+
 class RateLimitException(Exception):
     """
     频率限制
 
     """
 
+    def __init__(self, retry_after=None, remaining=0):
+        """
+        :param retry_after: 多少秒后可重试, 未知时为 None
+        :param remaining: 剩余次数
+        """
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+        self.remaining = remaining
+
 
 class RateLimit:
-    def __init__(self, key, limit=1, timeout=3600, delta=1, prefix="rl"):
+    FIXED = "fixed"  # 固定窗口, 被拒绝的请求也计数
+    SLIDING_LOG = "sliding_log"  # 滑动窗口日志, 精确, 内存与 limit 成正比
+    SLIDING_WINDOW = "sliding_window"  # 滑动窗口计数, 近似, 内存固定
+    TOKEN_BUCKET = "token_bucket"  # 令牌桶, 允许突发 limit 次
+
+    _scripts = {
+        SLIDING_LOG: _LUA_SLIDING_LOG,
+        SLIDING_WINDOW: _LUA_SLIDING_WINDOW,
+        TOKEN_BUCKET: _LUA_TOKEN_BUCKET,
+    }
+
+    def __init__(self, key, limit=1, timeout=3600, delta=1, prefix="rl", algorithm=FIXED, fail_open=None):
         """
         :param key:
-        :param timeout:
+        :param timeout: 窗口时长(秒)
+        :param algorithm: 限流算法, 除 FIXED 外均为单次 lua 脚本, 被拒绝的请求不计数
+        :param fail_open: 缓存后端不可用时是否放行, 默认取 settings.REDISX["RATE_LIMIT_FAIL_OPEN"]
 
         """
         self.locked = False
@@ -165,11 +1329,129 @@ class RateLimit:
         self.key = ":".join([prefix, key])
         self.delta = delta
         self.limit = limit
+        self.algorithm = algorithm
+        self.fail_open = fail_open
+        self.remaining = None
+        self.retry_after = None
+
+    def check(self):
+        """
+        :return: 是否通过, 同时更新 remaining/retry_after
+        """
+        return _check_rate_limit(self)
+
+    def _check(self):
+        if self.algorithm == self.FIXED:
+            cnt = incr(key=self.key, delta=self.delta, timeout=self.timeout)
+            self.remaining = max(self.limit - cnt, 0)
+            if cnt <= self.limit:
+                self.retry_after = 0
+                return True
+            ttl = cache.ttl(self.key) if hasattr(cache, "ttl") else None
+            self.retry_after = ttl if ttl and ttl > 0 else None
+            return False
+
+        allowed, remaining, retry_after = eval_script(
+            self._scripts[self.algorithm],
+            keys=[self.key],
+            args=[self.limit, int(self.timeout * 1000), self.delta, uuid.uuid4().hex],
+        )
+        self.remaining = remaining
+        self.retry_after = math.ceil(retry_after / 1000)
+        return bool(allowed)
+
+    def __enter__(self):
+        if not self.check():
+            raise RateLimitException(retry_after=self.retry_after, remaining=self.remaining)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def __aenter__(self):
+        if not await sync_to_async(self.check, thread_sensitive=False)():
+            raise RateLimitException(retry_after=self.retry_after, remaining=self.remaining)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+# 多规则固定窗口: 所有规则都通过才计数, 任一规则拒绝则都不计数
+# ARGV: delta, limit1, timeout1(ms), limit2, timeout2, ...
+# return {allowed, 拒绝的规则序号(从 1 开始), remaining, retry_after(ms)}
+_LUA_MULTI_FIXED = """
+local delta = tonumber(ARGV[1])
+local remaining = -1
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i * 2])
+    local cnt = tonumber(redis.call('GET', key)) or 0
+    if cnt + delta > limit then
+        local ttl = redis.call('PTTL', key)
+        if ttl < 0 then
+            ttl = tonumber(ARGV[i * 2 + 1])
+        end
+        return {0, i, math.max(limit - cnt, 0), ttl}
+    end
+    if remaining < 0 or limit - cnt - delta < remaining then
+        remaining = limit - cnt - delta
+    end
+end
+for i, key in ipairs(KEYS) do
+    if redis.call('INCRBY', key, delta) == delta then
+        redis.call('PEXPIRE', key, ARGV[i * 2 + 1])
+    end
+end
+return {1, 0, remaining, 0}
+"""
+
+RateLimitRule = namedtuple("RateLimitRule", ["key", "limit", "timeout"])
+
+
+class MultiRateLimit:
+    """
+    一个 key 的多条固定窗口规则, 一次 lua 脚本原子检查, key 格式与 RateLimit 一致
+
+        with MultiRateLimit([RateLimitRule("day:%s" % phone, 10, 86400), RateLimitRule("hour:%s" % phone, 5, 3600)]):
+            ...
+    """
+
+    def __init__(self, rules, delta=1, prefix="rl", fail_open=None):
+        """
+        :param rules: RateLimitRule 列表
+        :param delta: 每次计数
+        :param fail_open: 同 RateLimit
+        """
+        self.rules = rules
+        self.keys = [":".join([prefix, rule.key]) for rule in rules]
+        self.delta = delta
+        self.fail_open = fail_open
+        self.rule = None  # 拒绝的规则
+        self.remaining = None
+        self.retry_after = None
+
+    def check(self):
+        return _check_rate_limit(self)
+
+    def _check(self):
+        args = [self.delta]
+        for rule in self.rules:
+            args.extend([rule.limit, int(rule.timeout * 1000)])
+
+        allowed, idx, remaining, retry_after = eval_script(_LUA_MULTI_FIXED, keys=self.keys, args=args)
+        self.rule = self.rules[idx - 1] if idx else None
+        self.remaining = remaining
+        self.retry_after = math.ceil(retry_after / 1000)
+        return bool(allowed)
 
     def __enter__(self):
-        cnt = incr(key=self.key, delta=self.delta, timeout=self.timeout)
-        if cnt > self.limit:
-            raise RateLimitException
+        if not self.check():
+            raise RateLimitException(retry_after=self.retry_after, remaining=self.remaining)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         pass
+
+    async def __aenter__(self):
+        if not await sync_to_async(self.check, thread_sensitive=False)():
+            raise RateLimitException(retry_after=self.retry_after, remaining=self.remaining)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass